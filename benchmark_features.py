@@ -0,0 +1,80 @@
+import argparse
+import numpy as np
+import time
+
+from types import SimpleNamespace
+
+from imdb_absa.config import Config
+from imdb_absa.db import DB
+from imdb_absa.nlp import build_features
+
+
+def get_reviews(db, review_ids):
+    """ returns list of (genres, sentences, aspects) for analyzed reviews, as input for build_features """
+
+    sentences = db.get_review_sentence_aspects(review_ids)
+
+    reviews = []
+
+    for _, review in sentences.groupby('review_id', sort=True):
+
+        compounds = review.groupby('sentence_id', sort=True)['compound'].first().to_frame()
+
+        # each predicted aspect category is saved as separate row
+        aspects = [[SimpleNamespace(categories={a.category}, label=a.polarity) for a in sentence.itertuples(index=False) if a.category is not None]
+                   for _, sentence in review.groupby('sentence_id', sort=True)]
+
+        reviews.append((review['genres'].iloc[0], compounds, aspects))
+
+    return reviews
+
+
+if __name__ == "__main__":
+    """ Check that features built from predicted aspects in memory (as used by the GUI)
+        match the features of DB.get_review_polarities_sparse (as used for training the classifiers)
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--genre_id', type=int, help='filter by genre')
+    parser.add_argument('--limit', type=int, default=1000, help='maximum number of reviews')
+    args = parser.parse_args()
+
+    config = Config()
+
+    db = DB(config.database, pragmas=config.database_pragmas)
+
+    print('Getting review polarities')
+
+    start = time.perf_counter()
+    polarities = db.get_review_polarities_sparse(genre_id=args.genre_id).head(args.limit)
+    print(f'sql: {time.perf_counter() - start:.2f}s')
+
+    if len(polarities.index) == 0:
+        raise SystemExit('No analyzed reviews in database.')
+
+    features = db.get_review_polarities_input()
+
+    expected = polarities.iloc[:,polarities.columns.get_loc('binary_class') + 1:]
+
+    if list(expected.columns) != list(features.columns):
+        raise SystemExit('Column layout of classifier input differs from review polarities.')
+
+    reviews = get_reviews(db, polarities['id'].tolist())
+
+    start = time.perf_counter()
+    actual, _ = build_features(reviews, features)
+    print(f'build_features: {time.perf_counter() - start:.2f}s ({len(reviews) / (time.perf_counter() - start):.1f} reviews/s)')
+
+
+    # the review polarity in sql is averaged over sentences joined with aspects, i.e., weighted by number of aspects
+    columns = [i for i, column in enumerate(expected.columns) if column != 'mean_review_polarity']
+
+    differences = ~np.isclose(expected.values[:, columns].astype(np.float64), actual[:, columns])
+
+    print(f'{differences.any(axis=1).sum()} of {len(reviews)} reviews differ.')
+
+    for i in np.flatnonzero(differences.any(axis=0)):
+        print(f'  {expected.columns[columns[i]]}: {differences[:, i].sum()} reviews')
+
+    if differences.any():
+        raise SystemExit(1)
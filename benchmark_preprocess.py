@@ -0,0 +1,180 @@
+import argparse
+import nltk
+import pandas as pd
+import re
+import time
+
+from imdb_absa.config import Config
+from imdb_absa.nlp import NORMALIZATIONS, NONE_SENTENCES, SENTENCE_MAXLENGTH, compile_normalizations, normalize_review, split_reviews
+
+
+def normalize_pandas(pdSeries, normalForm):
+    """ reference implementation: one pandas replace call per group of normalization rules """
+
+    pattern, replacement = NORMALIZATIONS[0][0]
+    pdSeries = pdSeries.str.replace(pattern, replacement, regex=True)
+
+    for group in NORMALIZATIONS[1:]:
+        pdSeries = pdSeries.replace(regex=dict(group))
+
+    return pdSeries.str.normalize(normalForm).str.strip()
+
+
+def normalize_compiled(pdSeries, normalForm):
+    """ precompiled normalization rules, applied per review """
+
+    normalizations = compile_normalizations()
+
+    return pdSeries.apply(normalize_review, normalizations=normalizations, normalForm=normalForm)
+
+
+def split_legacy(text, sent_detector):
+    """ reference implementation: sentence splitting with uncompiled regex and f-string merging """
+
+    sentences = []
+    open_parentesis = False
+
+    for sentence in sent_detector.tokenize(text):
+
+        #clean up split sentences
+        if sentence in NONE_SENTENCES:
+            continue
+        #numbered list 1.
+        if re.fullmatch(r'#?(\d){1,2}[\.\)]+', sentence):
+            continue
+
+        sentence = re.sub(r'^(\d){1,2}[\.\)]+ ', '', sentence)
+
+        #inline numbered list 2.
+        if re.search(r'(?<! is)(?<! the)(?<! of)(?<! Volume) (\d)\. ', sentence):
+            nr_list = re.split(r'(?<! is)(?<! the)(?<! of)(?<! Volume) (\d)\. ', sentence)
+            for sentence in nr_list:
+                if sentence == '':
+                    continue
+
+                if (not sentences) or (re.match(r'[A-Z]', sentence)):
+                    sentences.append(sentence)
+                else:
+                    sentences[-1] = f"{sentences[-1]}{'' if (sentences[-1][-1] in '.,:;!?') else ','} {sentence}"
+
+            open_parentesis = False
+        #inline numbered list 3)
+        elif (not open_parentesis) and re.search(r' \d\) ', sentence) and not re.search(r'\(.* \d\) ', sentence):
+            nr_list = re.split(r' \d\) ', sentence)
+            for sentence in nr_list:
+                if sentence == '':
+                    continue
+
+                if (not sentences) or (re.match(r'[A-Z]', sentence)):
+                    sentences.append(sentence)
+                else:
+                    sentences[-1] = f"{sentences[-1]}{'' if (sentences[-1][-1] in '.,:;!?') else ','} {sentence}"
+
+        #fix for nltk splitting sentences too freely, whenever there is a punctuation
+        elif sentences and (sentence.startswith("'s ") or re.match(r'[\'"]?[\.,:;!\?\)]', sentence)):
+            sentences[-1] = f'{sentences[-1]}{sentence}'
+            open_parentesis = False
+        #join short sentences, e.g., 'Yes.', 'Why?'
+        elif (not ' ' in sentence) and any(char.isalpha() for char in sentence):
+            if not sentences: #one-word review beginning
+                sentences.append(sentence)
+                open_parentesis = True
+                continue
+
+            sentences[-1] = f'{sentences[-1]} {sentence}'
+            open_parentesis = False
+        #greedily split sentences with screwed punctuation
+        elif len(sentence) > SENTENCE_MAXLENGTH:
+            sentences.extend([f'{s.strip()}.' for s in re.split(r'[\.;](?=[ a-dfh-zA-Z])', sentence)])
+            open_parentesis = False
+        elif open_parentesis:
+            #TODO: consider more than two sentences in parentheses
+            sentences[-1] = f'{sentences[-1]} {sentence}'
+            open_parentesis = False
+        else:
+            sentences.append(sentence)
+
+        #keep parentheses together
+        if ('(' in sentence) and (not ')' in sentence):
+            open_parentesis = True
+
+    return sentences
+
+
+def split_reference(pdSeries, sent_detector):
+    """ reference implementation, applied per review """
+
+    return pdSeries.apply(split_legacy, sent_detector=sent_detector)
+
+
+def split_compiled(pdSeries, sent_detector):
+    """ precompiled splitter, applied to the batch of reviews """
+
+    return pd.Series(split_reviews(pdSeries, sent_detector), index=pdSeries.index)
+
+
+def benchmark(name, func, texts, *args):
+    """ runs func on texts and prints throughput """
+
+    start = time.perf_counter()
+    result = func(texts, *args)
+    duration = time.perf_counter() - start
+
+    print(f'{name}: {duration:.2f}s ({len(texts) / duration:.1f} reviews/s)')
+
+    return result
+
+
+def compare(expected, actual, max_examples):
+    """ prints number of differing results and some examples """
+
+    mismatches = expected != actual
+
+    print(f'{mismatches.sum()} of {len(expected)} results differ.')
+
+    for e, a in zip(expected[mismatches][:max_examples], actual[mismatches][:max_examples]):
+        print(f'  expected: {e!r}')
+        print(f'  actual:   {a!r}')
+
+    return mismatches.sum() == 0
+
+
+if __name__ == "__main__":
+    """ Compare output and throughput of preprocessing implementations on a review corpus
+        (e.g., aclImdb_reviews.csv created by train_00_convert_aclImdb.py)
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('csv', type=str, help='csv file with a "text" column')
+    parser.add_argument('--limit', type=int, help='maximum number of reviews')
+    parser.add_argument('--examples', type=int, default=3, help='number of differing results to print')
+    args = parser.parse_args()
+
+    config = Config()
+
+    print('Reading in reviews')
+
+    texts = pd.read_csv(args.csv, usecols=['text'], nrows=args.limit)['text']
+
+
+    print(f'Normalizing {len(texts)} reviews')
+
+    expected = benchmark('pandas replace', normalize_pandas, texts, config.pre_normal)
+    actual = benchmark('compiled rules', normalize_compiled, texts, config.pre_normal)
+
+    equal = compare(expected, actual, args.examples)
+
+
+    print(f'Splitting {len(texts)} reviews into sentences')
+
+    sent_detector = nltk.PunktTokenizer()
+
+    texts = expected
+
+    expected = benchmark('legacy splitter', split_reference, texts, sent_detector)
+    actual = benchmark('compiled splitter', split_compiled, texts, sent_detector)
+
+    equal = compare(expected, actual, args.examples) and equal
+
+    if not equal:
+        raise SystemExit(1)
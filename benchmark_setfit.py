@@ -0,0 +1,101 @@
+import argparse
+import time
+
+from imdb_absa.aspects import AspectTermIndex
+from imdb_absa.config import Config
+from imdb_absa.db import DB
+from imdb_absa.nlp import NLP
+
+
+def benchmark(name, nlp, sentences, aspect_terms, token_budget):
+    """ predicts aspects for sentences and prints throughput """
+
+    # warm up, so lazy initialization doesn't count
+    nlp.predict_absa(sentences[:8], aspect_terms, token_budget)
+
+    start = time.perf_counter()
+    _, aspects = nlp.predict_absa(sentences, aspect_terms, token_budget)
+    duration = time.perf_counter() - start
+
+    print(f'{name}: {duration:.2f}s ({len(sentences) / duration:.1f} sentences/s)')
+
+    return [{(aspect.text, aspect.ordinal): aspect.label for aspect in doc_aspects} for doc_aspects in aspects]
+
+
+def compare(expected, actual, sentences, max_examples):
+    """ prints agreement of extracted aspects and polarity labels """
+
+    same_aspects = 0
+    shared = 0
+    same_labels = 0
+    examples = []
+
+    for sentence, e, a in zip(sentences, expected, actual):
+
+        if e.keys() == a.keys():
+            same_aspects += 1
+        elif len(examples) < max_examples:
+            examples.append((sentence, e, a))
+
+        for key in e.keys() & a.keys():
+            shared += 1
+            if e[key] == a[key]:
+                same_labels += 1
+
+    print(f'aspect agreement: {same_aspects} of {len(expected)} sentences ({same_aspects / max(len(expected), 1):.1%})')
+    print(f'polarity agreement: {same_labels} of {shared} shared aspects ({same_labels / max(shared, 1):.1%})')
+
+    for sentence, e, a in examples:
+        print(f'  sentence: {sentence!r}')
+        print(f'    fp32: {sorted(e.items())}')
+        print(f'    int8: {sorted(a.items())}')
+
+
+if __name__ == "__main__":
+    """ Compare throughput and predictions of the setfit models in fp32 and dynamically quantized int8
+        on a held-out sample of sentences from the database
+        (and optionally the throughput with and without model_setfit_token_budget)
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limit', type=int, default=2000, help='number of sentences')
+    parser.add_argument('--genre_id', type=int, default=-1, help='filter by genre')
+    parser.add_argument('--threads', type=int, help='number of intra-op threads (default: config.json)')
+    parser.add_argument('--examples', type=int, default=3, help='number of differing sentences to print')
+    parser.add_argument('--compare_token_budget', action='store_true', help='also measure fp32 without model_setfit_token_budget')
+    args = parser.parse_args()
+
+    config = Config()
+
+    db = DB(config.database, pragmas=config.database_pragmas)
+
+    print('Getting sentences')
+
+    sentences = db.get_heldout_sentences(args.limit, args.genre_id)['text']
+
+    aspect_terms = AspectTermIndex(db.get_aspect_terms())
+
+    if len(sentences) == 0:
+        raise SystemExit('No sentences in database.')
+
+
+    print('Loading models')
+
+    threads = args.threads if args.threads is not None else config.model_setfit_threads
+
+    nlp = NLP(config.model_spacy, config.model_spacy_exclude, config.model_maverick, False, config.model_setfit, True
+             ,setfit_inference='fp32', setfit_threads=threads)
+
+
+    print(f'Predicting {len(sentences)} sentences')
+
+    if args.compare_token_budget:
+        benchmark('fp32 without token budget', nlp, sentences, aspect_terms, None)
+
+    expected = benchmark('fp32', nlp, sentences, aspect_terms, config.model_setfit_token_budget)
+
+    nlp.quantize_setfit()
+
+    actual = benchmark('int8', nlp, sentences, aspect_terms, config.model_setfit_token_budget)
+
+    compare(expected, actual, sentences, args.examples)
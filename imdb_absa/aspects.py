@@ -0,0 +1,70 @@
+import re
+
+from imdb_absa.metadata import trie_regex
+
+
+class AspectTermIndex:
+    """ finds the aspect terms contained in an aspect context in one scan
+
+        (replaces the loop over all aspect terms for every aspect)
+    """
+
+    def __init__(self, aspect_terms):
+        """ build combined regex from aspect terms
+
+          Arguments:
+            aspect_terms: DataFrame from DB.get_aspect_terms, sorted by length of term descending
+        """
+
+        # rank and category of each term, the first entry wins for duplicate terms
+        self._terms = dict()
+
+        for rank, a in enumerate(aspect_terms.itertuples(index=False)):
+            if len(a.term) != 0:
+                self._terms.setdefault(a.term, (rank, a.category))
+
+        # lookahead to find the longest term at every position
+        # (shorter terms at the same position are contained in the longer one, so never count)
+        self._regex = re.compile(f'(?=({trie_regex(self._terms)}))') if len(self._terms) != 0 else None
+
+    def categories(self, aspect):
+        """ returns categories for a given aspect context
+
+            the longest terms win, i.e., terms contained in longer found terms are ignored
+          , 'Overall' is dropped if there are other categories, and 'Other' returned if there are none
+        """
+
+        terms = []
+        categories = set()
+
+        if self._regex is not None:
+
+            found = {match.group(1) for match in self._regex.finditer(aspect) if match.group(1)}
+
+            for term in sorted(found, key=lambda term: self._terms[term][0]):
+                if not any(term in t for t in terms):
+                    terms.append(term)
+                    categories.add(self._terms[term][1])
+
+        if len(categories) > 1:
+            categories.discard('Overall')
+        elif len(categories) == 0:
+            categories.add('Other')
+
+        return categories
+
+    def categories_batch(self, aspects):
+        """ returns list of categories for a list of aspect contexts
+            (each distinct context is only scanned once)
+        """
+
+        cache = dict()
+        categories = []
+
+        for aspect in aspects:
+            if aspect not in cache:
+                cache[aspect] = self.categories(aspect)
+
+            categories.append(set(cache[aspect]))
+
+        return categories
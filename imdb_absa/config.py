@@ -9,6 +9,8 @@ class Config:
                conf = json.load(file)
 
                self.database = conf['database']
+               self.database_pragmas = conf['database_pragmas']
+               self.database_word_storage = conf['database_word_storage']
 
                self.import_chunk_size = conf['import_chunk_size']
                
@@ -31,6 +33,10 @@ class Config:
                
                self.pre_normal = conf['pre_normal']
                self.pre_coref_resolution = conf['pre_coref_resolution']
+               self.pre_workers = conf['pre_workers']
+               self.pre_chunk_size = conf['pre_chunk_size']
+               self.pre_spacy_batch_size = conf['pre_spacy_batch_size']
+               self.pre_spacy_processes = conf['pre_spacy_processes']
                
                self.export_sentences = conf['export_sentences']
                self.import_annotations = conf['import_annotations']
@@ -40,6 +46,11 @@ class Config:
                self.model_maverick = conf['model_maverick']
                self.model_setfit = conf['model_setfit']
                self.model_classifier = conf['model_classifier']
+               self.model_embedding_store = conf['model_embedding_store']
+               self.model_embedding_dtype = conf['model_embedding_dtype']
+               self.model_setfit_token_budget = conf['model_setfit_token_budget']
+               self.model_setfit_inference = conf['model_setfit_inference']
+               self.model_setfit_threads = conf['model_setfit_threads']
                
                self.dash_genre_filter = conf['dash_genre_filter']
                self.dash_highlight_with_context = conf['dash_highlight_with_context']
@@ -1,37 +1,178 @@
 import os
 import sqlite3
+import threading
 import time
 import itertools
+import numpy as np
 import pandas as pd
 import logging
+import json
 
+from collections import OrderedDict
 from contextlib import closing
 
+from imdb_absa.metadata import MetadataMatcher
+
+""" default pragmas for database connections
+    (WAL allows reading while another process writes)
+"""
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL'
+   ,'synchronous': 'NORMAL'
+   ,'cache_size': -65536 # in KiB, i.e., 64 MiB
+   ,'mmap_size': 268435456
+   ,'temp_store': 'MEMORY'
+   ,'busy_timeout': 30000 # in ms
+}
+
+
+# numpy scalars in object columns, e.g., ordinals of aspects, are bound as python values
+for numpy_type in (np.int64, np.int32, np.bool_):
+    sqlite3.register_adapter(numpy_type, int)
+sqlite3.register_adapter(np.float32, float)
+
+
+class PersistentConnection(sqlite3.Connection):
+    """ sqlite3 connection that is kept open for reuse
+        , close() only discards uncommitted changes and per-request settings
+    """
+
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+        self.execute('PRAGMA foreign_keys = OFF')
+
+    def close_connection(self):
+        super().close()
+
+
 class DB:
     """ encapsulates all database requests """
 
-    def __init__(self, connection : str):
+    def __init__(self, connection : str, metadata_cache_size = 64, pragmas = None, report_writes = False, word_storage = 'rows'):
         """ instanciate database encapsulation
         
           Arguments:
             connection: path to sqlite3 database file
+            metadata_cache_size: number of titles to keep metadata replacements for
+            pragmas: dict of pragmas for connections, overriding DEFAULT_PRAGMAS
+            report_writes: print number of rows and rows per second for bulk writes
+            word_storage: how import_words stores tokens
+                          'rows' - one row per token, indexed by word
+                          'arrays' - one row per sentence (smaller and faster to insert, but not indexed by word)
         """
 
         self._connection = connection
-        self._journal = f'{connection}-journal'
+        self._report_writes = report_writes
+        self._word_storage = word_storage
+
+        self._pragmas = dict(DEFAULT_PRAGMAS)
+        if pragmas is not None:
+            self._pragmas.update(pragmas)
+
+        # one connection per thread (and process)
+        self._local = threading.local()
+
+        # metadata replacements and matchers by title, least recently used first
+        # (shared by all threads, see refresh_metadata_cache for invalidation)
+        self._metadata_cache = OrderedDict()
+        self._metadata_cache_size = metadata_cache_size
+        self._metadata_cache_version = None
+        self._metadata_lock = threading.Lock()
 
     
     def connection(self):
-        """ returns a database connection """       
-        return sqlite3.connect(self._connection)        
-
-    def await_access(self):
-        """ check sqlite3 journal file to handle concurrent database requests """
-        counter = 0
-        while os.path.isfile(self._journal) and counter < 25:
-            time.sleep(0.5)
-            counter += 1     
+        """ returns the database connection of the current thread
+            (closing it only discards uncommitted changes, see PersistentConnection)
+        """
+
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is None or self._local.pid != os.getpid():
+            # new thread, or forked process
+            conn = sqlite3.connect(self._connection, timeout=self._pragmas.get('busy_timeout', 5000) / 1000, factory=PersistentConnection)
+
+            for pragma, value in self._pragmas.items():
+                conn.execute(f'PRAGMA {pragma} = {value}')
+
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+
+        return conn
+
+    def _bulk_write(self, conn, name, statement, rows):
+        """ executes a prepared statement for all rows
+            (within the current transaction, i.e., commit afterwards)
+        
+          Arguments:
+            conn: connection from self.connection()
+            name: name of the target for reporting
+            statement: sql statement with ? parameters
+            rows: iterable of parameter tuples
             
+          Returns:
+            number of rows
+        """
+        
+        count = 0
+        
+        def counted():
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+        
+        start = time.perf_counter()
+        
+        conn.executemany(statement, counted())
+        
+        if self._report_writes:
+            duration = time.perf_counter() - start
+            print(f'{name}: {count} rows in {duration:.2f}s ({count / max(duration, 1e-6):.0f} rows/s)')
+            
+        return count
+
+    def close(self):
+        """ close the database connection of the current thread """
+
+        conn = getattr(self._local, 'conn', None)
+
+        if conn is not None:
+            conn.close_connection()
+            self._local.conn = None
+            
+    def _increment_imdb_version(self, cmd):
+        """ flag changes to titles or principals, to invalidate cached metadata replacements """
+
+        cmd.execute('''UPDATE imdb_version SET version = version + 1''')
+
+        with self._metadata_lock:
+            self._metadata_cache.clear()
+            self._metadata_cache_version = None
+
+    def refresh_metadata_cache(self):
+        """ discard cached metadata replacements, if titles or principals were changed in the meantime
+            (by another process - call once per batch or title, not per lookup)
+        """
+
+        version = self.get_imdb_version()
+
+        with self._metadata_lock:
+            if version != self._metadata_cache_version:
+                self._metadata_cache.clear()
+                self._metadata_cache_version = version
+
+    def get_imdb_version(self):
+        """ get current version of titles and principals """
+
+        with closing(self.connection()) as conn:
+            try:
+                return conn.execute('''SELECT version FROM imdb_version''').fetchone()[0]
+            except sqlite3.OperationalError:
+                # database created before versioning
+                return 0
+
     def vacuum(self):
         """ helper function to clean and compress the database """
 
@@ -52,6 +193,96 @@ class DB:
                 cmd.execute('''VACUUM;''')   
 
 
+    def _has_table(self, conn, name):
+        """ checks whether a table exists """
+        
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (name,)).fetchone() is not None
+
+    def _assure_sentence_fts(self, cmd):
+        """ creates the full-text index of review sentences
+          , kept in sync with review_sentence by triggers for updates and deletes
+          , and by import_sentences for inserts
+            (existing sentences are indexed once, when the index is created)
+        """
+        
+        exists = cmd.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentence_fts'").fetchone() is not None
+        
+        try:
+            # external content, i.e., the sentences are not stored twice
+            cmd.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS sentence_fts USING fts5(
+                               sentence
+                              ,content='review_sentence'
+                              ,content_rowid='id'
+                              )''')
+                              
+        except sqlite3.OperationalError as e:
+            logging.warning(f'Full-text index of sentences not available, sampling sentences without it: {e}')
+            return
+        
+        cmd.execute('''CREATE TRIGGER IF NOT EXISTS review_sentence_fts_delete AFTER DELETE ON review_sentence BEGIN
+                         INSERT INTO sentence_fts(sentence_fts, rowid, sentence) VALUES ('delete', old.id, old.sentence);
+                       END''')
+                       
+        cmd.execute('''CREATE TRIGGER IF NOT EXISTS review_sentence_fts_update AFTER UPDATE OF sentence ON review_sentence BEGIN
+                         INSERT INTO sentence_fts(sentence_fts, rowid, sentence) VALUES ('delete', old.id, old.sentence);
+                         INSERT INTO sentence_fts(rowid, sentence) VALUES (new.id, new.sentence);
+                       END''')
+        
+        if not exists:
+            cmd.execute('''INSERT INTO sentence_fts(sentence_fts) VALUES ('rebuild')''')
+
+    def _assure_sentence_word_view(self, cmd):
+        """ creates the sentence_word view of the encoded tokens, with the columns of the former sentence_word table
+            (which is migrated to sentence_token, if it still exists)
+        """
+        
+        if cmd.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentence_word'").fetchone() is not None:
+        
+            cmd.execute('''INSERT OR IGNORE INTO vocabulary(word)
+                           SELECT DISTINCT word FROM sentence_word''')
+            
+            cmd.execute('''INSERT OR IGNORE INTO pos_tag(POS)
+                           SELECT DISTINCT POS FROM sentence_word''')
+                           
+            cmd.execute('''INSERT INTO sentence_token(id, sentence_id, word_id, pos_id, sentencePart)
+                           SELECT w.id, w.sentence_id, v.id, p.id, w.sentencePart
+                           FROM sentence_word w
+                           INNER JOIN vocabulary v
+                            ON v.word = w.word
+                           INNER JOIN pos_tag p
+                            ON p.POS = w.POS
+                           ORDER BY w.id''')
+            
+            cmd.execute('''DROP TABLE sentence_word''')
+        
+        # (recreated, so databases with an earlier definition get the current one)
+        cmd.execute('''DROP VIEW IF EXISTS sentence_word''')
+        
+        # tokens in arrays have no id
+        cmd.execute('''CREATE VIEW sentence_word AS
+                       SELECT t.id
+                             ,t.sentence_id
+                             ,v.word
+                             ,p.POS
+                             ,t.sentencePart
+                       FROM sentence_token t
+                       INNER JOIN vocabulary v
+                        ON v.id = t.word_id
+                       INNER JOIN pos_tag p
+                        ON p.id = t.pos_id
+                       UNION ALL
+                       SELECT NULL
+                             ,a.sentence_id
+                             ,v.word
+                             ,p.POS
+                             ,json_extract(t.value, '$[2]')
+                       FROM sentence_token_array a
+                       INNER JOIN json_each(a.tokens) t
+                       INNER JOIN vocabulary v
+                        ON v.id = json_extract(t.value, '$[0]')
+                       INNER JOIN pos_tag p
+                        ON p.id = json_extract(t.value, '$[1]')''')
+
     def assure_database(self):
         """ creates database file and schema objects if neccessary
         
@@ -61,6 +292,9 @@ class DB:
            imdb_title_genres(title_id, genre_id)
            imdb_name(id, primaryName, firstName, middleName, lastName, aliasName, noAliasName, birthYear, deathYear, ambiguous)
            imdb_principals(title_id, name_id, category, job, character, ambiguous)
+           imdb_version(version)
+           metadata_replacement(id, title_id, ordinal, category, mdType, strSearch, strReplace, ambiguous, conflicts, strSearchEscaped, lenSearch)
+           metadata_checksum(title_id, checksum)
            
            genre(id, displayName)
            #franchise(id, displayName, alternativeName, titlePart)
@@ -69,8 +303,15 @@ class DB:
       
            review(id, originalText, normalizedText, title_id, genre_flag, rating, tokenized, usage)
            review_sentence(id, review_id, sentence, polNeu, polNeg, polPos, polComp)
-           sentence_word(id, sentence_id, POS, word, sentencePart)
+           sentence_fts(sentence) - full-text index of review_sentence
+           vocabulary(id, word)
+           pos_tag(id, POS)
+           sentence_token(id, sentence_id, word_id, pos_id, sentencePart)
+           sentence_token_array(sentence_id, tokens)
+           sentence_word(id, sentence_id, word, POS, sentencePart) - view of sentence_token and sentence_token_array
            sentence_aspect(id, sentence_id, aspect_id, aspect_term, ordinal, sentiment_term, polarity, verified)
+           absa_prediction(sentence_hash, model_id, aspects)
+           review_features(review_id, mean_review_polarity, <aspect>_<polarity> counts, <aspect>_mean) - see get_review_polarities_sparse
 
         """
 
@@ -171,6 +412,39 @@ class DB:
                 cmd.execute('''CREATE INDEX IF NOT EXISTS index_principals_title ON imdb_principals(title_id)''')
                 cmd.execute('''CREATE INDEX IF NOT EXISTS index_principals_name ON imdb_principals(name_id)''')
 
+                # incremented whenever titles or principals change, to invalidate cached metadata replacements
+                cmd.execute('''CREATE TABLE IF NOT EXISTS imdb_version(
+                               version INTEGER NOT NULL
+                              )''')
+
+                cmd.execute('''INSERT INTO imdb_version(version)
+                               SELECT 0 WHERE NOT EXISTS (SELECT * FROM imdb_version)''')
+
+
+                cmd.execute('''CREATE TABLE IF NOT EXISTS metadata_replacement(
+                               id INTEGER PRIMARY KEY
+                              ,title_id TEXT NOT NULL
+                              ,ordinal INTEGER NOT NULL
+                              ,category TEXT NOT NULL
+                              ,mdType TEXT NOT NULL
+                              ,strSearch TEXT NOT NULL
+                              ,strReplace TEXT NOT NULL
+                              ,ambiguous INTEGER DEFAULT (0) NOT NULL
+                              ,conflicts INTEGER DEFAULT (0) NOT NULL
+                              ,strSearchEscaped TEXT NOT NULL
+                              ,lenSearch INTEGER NOT NULL
+                              ,FOREIGN KEY(title_id) REFERENCES imdb_title(id) ON DELETE CASCADE
+                              )''')
+
+                cmd.execute('''CREATE INDEX IF NOT EXISTS index_metadata_replacement_title ON metadata_replacement(title_id, ordinal)''')
+
+                # checksum of the imdb data the replacements were derived from, to rebuild changed titles only
+                cmd.execute('''CREATE TABLE IF NOT EXISTS metadata_checksum(
+                               title_id TEXT PRIMARY KEY
+                              ,checksum INTEGER NOT NULL
+                              ,FOREIGN KEY(title_id) REFERENCES imdb_title(id) ON DELETE CASCADE
+                              )''')
+
                 # -- not implemented --
                 # cmd.execute('''CREATE TABLE IF NOT EXISTS franchise(
                                # id INTEGER PRIMARY KEY
@@ -248,20 +522,46 @@ class DB:
                               )''')
                               
                 cmd.execute('''CREATE INDEX IF NOT EXISTS index_sentence_review ON review_sentence(review_id)''')
+                
+                self._assure_sentence_fts(cmd)
 
 
-                cmd.execute('''CREATE TABLE IF NOT EXISTS sentence_word(
+                # words and POS tags are stored once, and referenced by id
+                cmd.execute('''CREATE TABLE IF NOT EXISTS vocabulary(
                                id INTEGER PRIMARY KEY
-                              ,sentence_id INTEGER NOT NULL
                               ,word TEXT NOT NULL
+                              )''')
+                              
+                cmd.execute('''CREATE UNIQUE INDEX IF NOT EXISTS index_vocabulary ON vocabulary(word)''')
+                
+                cmd.execute('''CREATE TABLE IF NOT EXISTS pos_tag(
+                               id INTEGER PRIMARY KEY
                               ,POS TEXT NOT NULL
+                              )''')
+                              
+                cmd.execute('''CREATE UNIQUE INDEX IF NOT EXISTS index_pos_tag ON pos_tag(POS)''')
+                
+                # one row per token (word_storage 'rows')
+                cmd.execute('''CREATE TABLE IF NOT EXISTS sentence_token(
+                               id INTEGER PRIMARY KEY
+                              ,sentence_id INTEGER NOT NULL
+                              ,word_id INTEGER NOT NULL
+                              ,pos_id INTEGER NOT NULL
                               ,sentencePart INTEGER DEFAULT(0) NOT NULL
                               ,FOREIGN KEY(sentence_id) REFERENCES review_sentence(id) ON DELETE CASCADE
                               )''')
                               
-                cmd.execute('''CREATE INDEX IF NOT EXISTS index_word_sentence ON sentence_word(sentence_id)''')
-                cmd.execute('''CREATE INDEX IF NOT EXISTS index_word_pos ON sentence_word(pos, word)''')
-                cmd.execute('''CREATE INDEX IF NOT EXISTS index_word_sentencePart ON sentence_word(word, sentencePart)''')
+                cmd.execute('''CREATE INDEX IF NOT EXISTS index_token_sentence ON sentence_token(sentence_id)''')
+                cmd.execute('''CREATE INDEX IF NOT EXISTS index_token_word ON sentence_token(word_id)''')
+                
+                # one row per sentence, with a json array of [word_id, pos_id, sentencePart] per token (word_storage 'arrays')
+                cmd.execute('''CREATE TABLE IF NOT EXISTS sentence_token_array(
+                               sentence_id INTEGER PRIMARY KEY
+                              ,tokens TEXT NOT NULL
+                              ,FOREIGN KEY(sentence_id) REFERENCES review_sentence(id) ON DELETE CASCADE
+                              )''')
+                
+                self._assure_sentence_word_view(cmd)
              
 
                 cmd.execute('''CREATE TABLE IF NOT EXISTS sentence_aspect(
@@ -281,6 +581,19 @@ class DB:
                 cmd.execute('''CREATE INDEX IF NOT EXISTS index_aspect_sentence ON sentence_aspect(sentence_id)''')
 
 
+                # cache of predicted aspects (as json list of [aspect_term, ordinal, context, polarity]) per sentence text and setfit model
+                cmd.execute('''CREATE TABLE IF NOT EXISTS absa_prediction(
+                               sentence_hash TEXT NOT NULL
+                              ,model_id TEXT NOT NULL
+                              ,aspects TEXT NOT NULL
+                              ,PRIMARY KEY(sentence_hash, model_id)
+                              ) WITHOUT ROWID''')
+
+
+                # aggregated classifier inputs per review, see get_review_polarities_sparse
+                self._assure_review_features(conn)
+
+
                 conn.commit()
                 
        
@@ -329,7 +642,9 @@ class DB:
                                  OR subtitle LIKE 'Part %'
                                  OR subtitle LIKE 'Vol. %'
                             ''')
-               
+
+                self._increment_imdb_version(cmd)
+
                 conn.commit()
 
     def get_titles(self):
@@ -395,6 +710,8 @@ class DB:
                             WHERE import_principals.nconst IN (SELECT id FROM imdb_name)
                             ''')
 
+                self._increment_imdb_version(cmd)
+
                 conn.commit()
 
     def import_aspects(self, aspects):
@@ -448,7 +765,9 @@ class DB:
                             FROM (SELECT id, firstName, middleName, lastName, aliasName FROM import_names) AS import
                             WHERE import.id = imdb_name.id
                             ''')
-                
+
+                self._increment_imdb_version(cmd)
+
                 conn.commit()    
 
     def update_names_ambiguous(self, ambiguous_names):
@@ -533,7 +852,9 @@ class DB:
                                FROM (SELECT name FROM import_names) AS import
                                WHERE import.name = imdb_title.subtitle
                             ''')
-                
+
+                self._increment_imdb_version(cmd)
+
                 conn.commit()  
  
                                  
@@ -546,9 +867,11 @@ class DB:
                                  ''', self.connection())    
        
     def import_reviews(self, reviews):
-        """ import reviews """
+        """ import reviews for titles in the database
         
-        reviews.to_sql(con=self.connection(), name='import_reviews', if_exists='replace')
+          Returns:
+            number of reviews for titles in the database
+        """
     
         col_text = 'text'
         for column in reviews.columns.values:
@@ -556,56 +879,51 @@ class DB:
                 col_text = column
                 break
     
+        titles = reviews['title_id'].dropna().unique().tolist()
+    
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:            
-
-                count = cmd.execute(f'''SELECT COUNT(*)
-                                        FROM import_reviews
-                                        WHERE EXISTS (SELECT id FROM imdb_title WHERE imdb_title.id = import_reviews.title_id)
-                                    ''').fetchone()[0]
-
-                cmd.execute(f'''INSERT OR IGNORE INTO review(originalText, title_id, rating, usage)
-                               SELECT {col_text}, title_id, rating, usage
-                               FROM import_reviews
-                               WHERE EXISTS (SELECT id FROM imdb_title WHERE imdb_title.id = import_reviews.title_id)
-                            ''')
+        
+            existing = set()
+            
+            # (in batches, to stay below the sqlite limit of query parameters)
+            for start in range(0, len(titles), 900):
+                ids = titles[start:start + 900]
                 
-                cmd.execute('''UPDATE review
+                existing.update(row[0] for row in conn.execute(f'''SELECT id FROM imdb_title
+                                                                    WHERE id IN ({','.join('?' * len(ids))})
+                                                                 ''', ids))
+            
+            reviews = reviews[reviews['title_id'].isin(existing)]
+
+            self._bulk_write(conn, 'review', '''INSERT OR IGNORE INTO review(originalText, title_id, rating, usage)
+                                                 VALUES(?, ?, ?, ?)'''
+                            , zip(reviews[col_text].tolist(), reviews['title_id'].tolist(), reviews['rating'].tolist(), reviews['usage'].tolist()))
+            
+            conn.execute('''UPDATE review
                               SET genre_flag = genres.flag
                               FROM (SELECT g.[title_id], SUM(power(2, g.genre_id)) AS flag
                                     FROM imdb_title_genres g
                                     GROUP BY g.[title_id]) AS genres
                               WHERE genres.title_id = review.title_id
                             ''')
+            
+            conn.commit()
                 
-                conn.commit()
-                
-                cmd.execute('''DROP TABLE import_reviews''')
-                
-                conn.commit()
-                
-        return count
+        return len(reviews.index)
 
     def update_reviews(self, reviews):
         """ update reviews with normalized text
             (before metadata replacement)
         """
         
-        reviews.to_sql(con=self.connection(), name='import_reviews', if_exists='replace')
-        
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:            
-
-                cmd.execute('''CREATE INDEX IF NOT EXISTS index_import_reviews ON import_reviews(review_id)''')
-
-                cmd.execute('''UPDATE review
-                            SET normalizedText = import.normalizedText
-                            FROM (SELECT review_id, normalizedText FROM import_reviews) AS import
-                            WHERE import.review_id = review.id''')
-                
-                cmd.execute('''DROP TABLE import_reviews''')
-                
-                conn.commit()    
+        
+            self._bulk_write(conn, 'review', '''UPDATE review
+                                                 SET normalizedText = ?
+                                                 WHERE id = ?'''
+                            , zip(reviews['normalizedText'].tolist(), reviews['review_id'].tolist()))
+            
+            conn.commit()    
     
     
     def get_new_sentence_id(self):
@@ -626,70 +944,126 @@ class DB:
         
     
     def import_sentences(self, sentences):
-        """ import review sentences """
+        """ import review sentences
+        
+          Arguments:
+            sentences: DataFrame indexed by sentence id, see get_new_sentence_id
+                     , with columns review_id, sentence, neu, neg, pos and compound
+        """
         
-        sentences.to_sql(con=self.connection(), name='import_sentences', index_label='id', if_exists='replace')
+        if len(sentences.index) == 0:
+            return
+        
+        first_id, last_id = int(sentences.index.min()), int(sentences.index.max())
         
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:            
 
-                cmd.execute('''PRAGMA foreign_keys = ON;''')
-                
-                cmd.execute('''INSERT OR IGNORE INTO [review_sentence]
-                               ([id]
-                               ,[review_id]
-                               ,[sentence]
-                               ,[polNeu]
-                               ,[polNeg]
-                               ,[polPos]
-                               ,[polComp])
-                            SELECT
-                               [id]
-                              ,[review_id]
-                              ,[sentence]
-                              ,[neu]
-                              ,[neg]
-                              ,[pos]
-                              ,[compound]
-                            FROM [import_sentences]
-                            ''')
-
-                conn.commit() 
+            conn.execute('''PRAGMA foreign_keys = ON;''')
+            
+            # existing sentences are ignored, and already in the full-text index
+            existing = [row[0] for row in conn.execute('''SELECT id FROM review_sentence
+                                                          WHERE id BETWEEN ? AND ?''', (first_id, last_id))]
+            
+            self._bulk_write(conn, 'review_sentence', '''INSERT OR IGNORE INTO [review_sentence]
+                                                            ([id]
+                                                            ,[review_id]
+                                                            ,[sentence]
+                                                            ,[polNeu]
+                                                            ,[polNeg]
+                                                            ,[polPos]
+                                                            ,[polComp])
+                                                          VALUES(?, ?, ?, ?, ?, ?, ?)'''
+                            , zip(sentences.index.tolist(), sentences['review_id'].tolist(), sentences['sentence'].tolist()
+                                 ,sentences['neu'].tolist(), sentences['neg'].tolist(), sentences['pos'].tolist(), sentences['compound'].tolist()))
+
+            if self._has_table(conn, 'sentence_fts'):
+                # indexed in one statement, which is several times faster than a trigger for each inserted row
+                conn.execute('''INSERT INTO sentence_fts(rowid, sentence)
+                                SELECT id, sentence
+                                FROM review_sentence
+                                WHERE id BETWEEN ? AND ?
+                                  AND id NOT IN (SELECT value FROM json_each(?))
+                             ''', (first_id, last_id, json.dumps(existing)))
+
+            conn.commit()  
+    
+    def _lookup_ids(self, conn, table, column, values):
+        """ returns dict of value: id for a lookup table, i.e., vocabulary or pos_tag
+            (missing values are added)
+        """
+        
+        conn.executemany(f'''INSERT OR IGNORE INTO {table}({column}) VALUES(?)''', ((value,) for value in values))
+        
+        ids = dict()
+        
+        # (in batches, to stay below the sqlite limit of query parameters)
+        for start in range(0, len(values), 900):
+            batch = values[start:start + 900]
+            
+            ids.update(conn.execute(f'''SELECT {column}, id FROM {table}
+                                        WHERE {column} IN ({','.join('?' * len(batch))})
+                                     ''', batch).fetchall())
+        
+        return ids
     
     def import_words(self, words):
-        """ import words """
+        """ import words and mark their reviews as tokenized
         
-        words.to_sql(con=self.connection(), name='import_words', index_label='sentence_id', if_exists='replace')
+          Arguments:
+            words: DataFrame indexed by sentence id, with columns POS, word and sentencePart
+                   (the sentences need to be imported beforehand, see import_sentences)
+        """
+        
+        sentence_ids = set(words.index.unique().tolist())
         
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:      
+        
+            conn.execute('''PRAGMA foreign_keys = ON;''')
             
-                cmd.execute('''PRAGMA foreign_keys = ON;''')
+            word_ids = words['word'].map(self._lookup_ids(conn, 'vocabulary', 'word', words['word'].unique().tolist()))
+            pos_ids = words['POS'].map(self._lookup_ids(conn, 'pos_tag', 'POS', words['POS'].unique().tolist()))
+            
+            if self._word_storage == 'arrays':
+            
+                # tokens of each sentence in order
+                order = np.argsort(words.index.to_numpy(), kind='stable')
                 
-                cmd.execute('''INSERT OR IGNORE INTO [sentence_word]
-                                   ([sentence_id]
-                                   ,[POS]
-                                   ,[word]
-                                   ,[sentencePart])
-                              SELECT [sentence_id]
-                                  ,[POS]
-                                  ,[word]
-                                  ,[sentencePart]
-                              FROM [import_words]
-                            ''')
-
-                cmd.execute('''UPDATE review
-                               SET tokenized = 1
-                               FROM (SELECT DISTINCT review_id FROM import_sentences) AS import
-                               WHERE import.review_id = review.id
-                            ''')
-                            
-                conn.commit()   
+                sentences = words.index.to_numpy()[order]
+                starts = np.flatnonzero(np.r_[True, sentences[1:] != sentences[:-1]])
+                ends = np.r_[starts[1:], len(sentences)]
                 
-                cmd.execute('''DROP TABLE import_sentences''')
-                cmd.execute('''DROP TABLE import_words''')
-    
-                conn.commit() 
+                tokens = np.column_stack((word_ids.to_numpy()[order], pos_ids.to_numpy()[order], words['sentencePart'].to_numpy()[order])).tolist()
+                
+                self._bulk_write(conn, 'sentence_token_array', '''INSERT OR IGNORE INTO [sentence_token_array]
+                                                                   ([sentence_id]
+                                                                   ,[tokens])
+                                                                 VALUES(?, ?)'''
+                                , ((int(sentences[start]), json.dumps(tokens[start:end], separators=(',', ':'))) for start, end in zip(starts, ends)))
+            
+            else:
+            
+                self._bulk_write(conn, 'sentence_token', '''INSERT OR IGNORE INTO [sentence_token]
+                                                             ([sentence_id]
+                                                             ,[word_id]
+                                                             ,[pos_id]
+                                                             ,[sentencePart])
+                                                           VALUES(?, ?, ?, ?)'''
+                                , zip(words.index.tolist(), word_ids.tolist(), pos_ids.tolist(), words['sentencePart'].tolist()))
+
+            if len(sentence_ids) != 0:
+            
+                # sentence ids of one import are consecutive, so a range scan finds their reviews
+                review_ids = {review_id for sentence_id, review_id in conn.execute('''SELECT id, review_id
+                                                                                        FROM review_sentence
+                                                                                        WHERE id BETWEEN ? AND ?
+                                                                                     ''', (min(sentence_ids), max(sentence_ids)))
+                              if sentence_id in sentence_ids}
+                
+                conn.executemany('''UPDATE review
+                                    SET tokenized = 1
+                                    WHERE id = ?''', ((review_id,) for review_id in review_ids))
+                            
+            conn.commit()    
     
     def get_genres_for_title(self, title_id):
         """ returns list of genre names for a given title """
@@ -719,16 +1093,181 @@ class DB:
                                  ''', self.connection())
         
     def get_metadata_replacements(self, title_id, include_firstNames=False):
-        """ get metadata replacements for an imdb title"""
+        """ get metadata replacements for an imdb title
+            (cached - do not modify the returned DataFrame)
+        """
+
+        return self._get_cached_metadata(title_id, include_firstNames)['metadata']
+
+    def get_metadata_matcher(self, title_id):
+        """ get compiled metadata matcher for an imdb title, see nlp.replace_metadata """
+
+        cached = self._get_cached_metadata(title_id, False)
+
+        if cached['matcher'] is None:
+            # (compiled at most a few times, if threads race for the same title)
+            cached['matcher'] = MetadataMatcher(cached['metadata'])
+
+        return cached['matcher']
+
+    def _get_cached_metadata(self, title_id, include_firstNames):
+        """ get cache entry for an imdb title, query metadata replacements if not cached """
+
+        key = (title_id, include_firstNames)
+
+        with self._metadata_lock:
+            cached = self._metadata_cache.get(key)
+
+            if cached is not None:
+                self._metadata_cache.move_to_end(key)
+                return cached
+
+        # query outside the lock, so other threads are not blocked meanwhile
+        cached = {'metadata': self._query_metadata_replacements(title_id, include_firstNames)
+                 ,'matcher': None}
+
+        with self._metadata_lock:
+            # keep the entry of another thread that was faster
+            cached = self._metadata_cache.setdefault(key, cached)
+            self._metadata_cache.move_to_end(key)
+
+            if len(self._metadata_cache) > self._metadata_cache_size:
+                self._metadata_cache.popitem(last=False)
+
+        return cached
+
+    def _query_metadata_replacements(self, title_id, include_firstNames):
+        """ query metadata replacements for an imdb title """
+
+        query = f'''SELECT category, mdType, strSearch, strReplace, ambiguous, conflicts, strSearchEscaped, lenSearch
+                    FROM metadata_replacement
+                    WHERE title_id = '{title_id}'
+                    {'' if include_firstNames else "AND mdType != 'firstName'"}
+                    ORDER BY ordinal
+                 '''
+
+        metadata = pd.read_sql_query(query, self.connection(), dtype={'ambiguous':bool, 'conflicts':bool})
+
+        if len(metadata.index) == 0 and not self._has_metadata_replacements(title_id):
+            # title not yet materialized, e.g., database created before metadata_replacement
+            # (computed without storing, to keep lookups read only)
+            logging.warning(f"Metadata replacements for '{title_id}' are not stored yet, please run setup_01_create_database.py to build them once.")
+            
+            metadata = self._compute_metadata_replacements([title_id])
+            
+            if not include_firstNames:
+                metadata = metadata[metadata['mdType'] != 'firstName']
+                
+            metadata = metadata.sort_values(by='ordinal')[['category', 'mdType', 'strSearch', 'strReplace', 'ambiguous', 'conflicts', 'strSearchEscaped', 'lenSearch']]
+            metadata = metadata.astype({'ambiguous':bool, 'conflicts':bool}).reset_index(drop=True)
+
+        if len(metadata.index) == 0:
+            logging.warning(f"No metadata found for '{title_id}'. Please make sure you typed the correct id, you imported the current imdb dataset, and the movie is not filtered out by the 'imdb_' entries in the config.")
+
+        return metadata
+
+    def _has_metadata_replacements(self, title_id):
+        """ check if metadata replacements have been materialized for an imdb title """
+
+        with closing(self.connection()) as conn:
+            return conn.execute(f'''SELECT 1 FROM metadata_checksum WHERE title_id = '{title_id}' ''').fetchone() is not None
+
+    def get_metadata_checksums(self, title_ids = None):
+        """ get checksums of the imdb data metadata replacements are derived from
+            , i.e., of titles, principals and names, optionally for given titles only
+        """
+
+        title_filter = ''
+        if title_ids is not None:
+            ids = ','.join(f"'{title_id}'" for title_id in title_ids)
+            title_filter = f'WHERE id IN ({ids})'
+
+        titles = pd.read_sql_query(f'''SELECT id AS title_id, primaryTitle, subtitle, ambiguous_title, ambiguous_subtitle
+                                       FROM imdb_title
+                                       {title_filter}
+                                    ''', self.connection())
+
+        principals = pd.read_sql_query(f'''SELECT p.title_id, p.category, p.character, p.ambiguous
+                                                 ,primaryName, firstName, lastName, aliasName, noAliasName, n.ambiguous AS ambiguous_name
+                                           FROM imdb_principals p
+                                           INNER JOIN imdb_name n
+                                            ON p.name_id = n.id
+                                           WHERE p.title_id IN (SELECT id FROM imdb_title {title_filter})
+                                        ''', self.connection())
+
+        # order-independent sum of row hashes per title
+        checksums = pd.concat([pd.util.hash_pandas_object(titles, index=False).groupby(titles['title_id']).sum()
+                              ,pd.util.hash_pandas_object(principals, index=False).groupby(principals['title_id']).sum()]
+                             ).groupby(level=0).sum()
+
+        # sqlite integers are signed
+        return checksums.astype('uint64').astype('int64').rename('checksum')
+
+    def update_metadata_replacements(self, title_ids = None, chunk_size = 500):
+        """ materialize metadata replacements for new or changed titles
         
+          Arguments:
+            title_ids: titles to check, pass None for all titles
+            chunk_size: number of titles to process at once
+            
+          Returns:
+            number of updated titles
+        """
+
+        checksums = self.get_metadata_checksums(title_ids)
+
+        with closing(self.connection()) as conn:
+            current = dict(conn.execute('''SELECT title_id, checksum FROM metadata_checksum''').fetchall())
+
+        changed = checksums[[current.get(title_id) != checksum for title_id, checksum in checksums.items()]]
+
+        for start in range(0, len(changed.index), chunk_size):
+            chunk = changed.iloc[start:start + chunk_size]
+
+            metadata = self._compute_metadata_replacements(chunk.index)
+
+            with closing(self.connection()) as conn:
+                with closing(conn.cursor()) as cmd:
+
+                    cmd.execute('''PRAGMA foreign_keys = ON;''')
+
+                    ids = ','.join(f"'{title_id}'" for title_id in chunk.index)
+
+                    cmd.execute(f'''DELETE FROM metadata_replacement WHERE title_id IN ({ids})''')
+
+                    cmd.executemany('''INSERT INTO metadata_replacement(title_id, ordinal, category, mdType, strSearch, strReplace
+                                                                      , ambiguous, conflicts, strSearchEscaped, lenSearch)
+                                       VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'''
+                                   , metadata[['title_id', 'ordinal', 'category', 'mdType', 'strSearch', 'strReplace'
+                                             , 'ambiguous', 'conflicts', 'strSearchEscaped', 'lenSearch']].itertuples(index=False, name=None))
+
+                    cmd.executemany('''INSERT OR REPLACE INTO metadata_checksum(title_id, checksum) VALUES(?, ?)'''
+                                   , chunk.items())
+
+                    conn.commit()
+
+        if len(changed.index) != 0:
+            with closing(self.connection()) as conn:
+                with closing(conn.cursor()) as cmd:
+                    self._increment_imdb_version(cmd)
+                    conn.commit()
+
+        return len(changed.index)
+
+    def _compute_metadata_replacements(self, title_ids):
+        """ compute metadata replacements for imdb titles (incl. first names) """
+        
+        ids = ','.join(f"'{title_id}'" for title_id in title_ids)
+
         # get title / subtitle, principal names and character names
         # incl. ambiguous flag to identify names unfit for regex replacement
         metadata = pd.read_sql_query(f'''WITH cteTitle AS
-                                        (SELECT id, REPLACE(primaryTitle, '¡','') AS primaryTitle, subtitle
+                                        (SELECT id AS title_id, REPLACE(primaryTitle, '¡','') AS primaryTitle, subtitle
                                                 ,ambiguous_title, ambiguous_subtitle
-                                         FROM imdb_title WHERE id = '{title_id}')
+                                         FROM imdb_title WHERE id IN ({ids}))
                                     ,ctePrincipals AS
-                                        (SELECT CASE WHEN p.category = 'self' THEN 'the person' ELSE 'the ' || category END AS category
+                                        (SELECT p.title_id
+                                               ,CASE WHEN p.category = 'self' THEN 'the person' ELSE 'the ' || category END AS category
                                                ,p.character
                                                ,primaryName, firstName, lastName, aliasName, noAliasName
                                                ,n.ambiguous AS ambiguous_name
@@ -736,77 +1275,76 @@ class DB:
                                           FROM [imdb_principals] p
                                           INNER JOIN imdb_name n
                                            ON p.name_id = n.id
-                                          WHERE p.title_id = '{title_id}'
+                                          WHERE p.title_id IN ({ids})
                                             AND p.category NOT LIKE '%\_%' ESCAPE '\\')
                                             
-                                    SELECT 'WORK_OF_ART' AS category
+                                    SELECT title_id
+                                         , 'WORK_OF_ART' AS category
                                          , mdType
                                          , strSearch AS strSearch
                                          , 'this movie' AS strReplace
                                          , ambiguous
                                     FROM
                                     (  
-                                        SELECT 'title' AS mdType, primaryTitle AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, primaryTitle AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(primaryTitle, '!', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(primaryTitle, '!', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(primaryTitle, '?', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(primaryTitle, '?', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(primaryTitle, ' - ', '- ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(primaryTitle, ' - ', '- ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(primaryTitle, ': The Movie', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(primaryTitle, ': The Movie', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         WHERE primaryTitle LIKE '%: The Movie'
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE([primaryTitle], ':', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE([primaryTitle], ':', '') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(REPLACE([primaryTitle], ':', ''), ' - ', ' ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(REPLACE([primaryTitle], ':', ''), ' - ', ' ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
-                                        SELECT 'title' AS mdType, REPLACE(REPLACE([primaryTitle], ':', ''), ' - ', '- ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
+                                        SELECT title_id, 'title' AS mdType, REPLACE(REPLACE([primaryTitle], ':', ''), ' - ', '- ') AS strSearch, ambiguous_title AS ambiguous FROM cteTitle
                                         UNION
                                         
-                                        SELECT 'subtitle' AS mdType,  subtitle AS strSearch, ambiguous_subtitle AS ambiguous
+                                        SELECT title_id, 'subtitle' AS mdType,  subtitle AS strSearch, ambiguous_subtitle AS ambiguous
                                         FROM cteTitle WHERE subtitle IS NOT NULL
                                     ) AS titles
 
                                     UNION ALL
                                     
-                                    SELECT 'PERSON' AS category
+                                    SELECT title_id
+                                         , 'PERSON' AS category
                                          , mdType
                                          , strSearch
                                          , strReplace
                                          , ambiguous
                                     FROM
                                     (
-                                        SELECT 'firstName' AS mdType, firstName AS strSearch, 'firstName' AS strReplace, 0 AS ambiguous
+                                        SELECT title_id, 'firstName' AS mdType, firstName AS strSearch, 'firstName' AS strReplace, 0 AS ambiguous
                                         FROM ctePrincipals WHERE firstName IS NOT NULL
                                         UNION
                                         
-                                        SELECT 'name' AS mdType, primaryName AS strSearch, category AS strReplace
+                                        SELECT title_id, 'name' AS mdType, primaryName AS strSearch, category AS strReplace
                                               ,CASE WHEN lastName IS NULL THEN ambiguous_name ELSE 0 END AS ambiguous
                                         FROM ctePrincipals WHERE noAliasName IS NULL
                                         UNION
-                                        SELECT 'name' AS mdType, aliasName AS strSearch, category AS strReplace
+                                        SELECT title_id, 'name' AS mdType, aliasName AS strSearch, category AS strReplace
                                               ,ambiguous_name AS ambiguous
                                         FROM ctePrincipals WHERE aliasName IS NOT NULL
                                         UNION
-                                        SELECT 'name' AS mdType, noAliasName AS strSearch, category AS strReplace, 0 AS ambiguous
+                                        SELECT title_id, 'name' AS mdType, noAliasName AS strSearch, category AS strReplace, 0 AS ambiguous
                                         FROM ctePrincipals WHERE noAliasName IS NOT NULL
                                         UNION
-                                        SELECT 'name' AS mdType, lastName AS strSearch, category AS strReplace
+                                        SELECT title_id, 'name' AS mdType, lastName AS strSearch, category AS strReplace
                                               ,ambiguous_name AS ambiguous
                                         FROM ctePrincipals WHERE lastName IS NOT NULL
                                         UNION
                                         
-                                        SELECT 'character' AS mdType, character AS strSearch, 'the character' AS strReplace
+                                        SELECT title_id, 'character' AS mdType, character AS strSearch, 'the character' AS strReplace
                                               ,ambiguous_character AS ambiguous
                                         FROM ctePrincipals
                                         WHERE character IS NOT NULL
                                     ) AS names 
                                     ''', self.connection(), dtype={'ambiguous':bool})
         
-        if len(metadata.index) == 0:
-            logging.warning(f"No metadata found for '{title_id}'. Please make sure you typed the correct id, you imported the current imdb dataset, and the movie is not filtered out by the 'imdb_' entries in the config.")
-        
         # replace abbreviations etc., to match nlp.normalize_reviews output
         metadata['strSearch'] = metadata['strSearch'].replace(regex={
                                 r'([a-z])\.([A-Z])':r'\1. \2'
@@ -846,31 +1384,30 @@ class DB:
         # add main character first or last name, if equal to title
         # TODO: properly parse all character descriptions, names, aliases etc. instead
         filter_title = (metadata['category'] == 'WORK_OF_ART')
+        titles = pd.MultiIndex.from_frame(metadata[filter_title][['title_id', 'strSearch']])
         
         ch_md = metadata[(metadata['mdType'] == 'character') & metadata['strSearch'].str.contains(' ')].copy()
         if len(ch_md.index) != 0:
             ch_md['strSearch'] = ch_md['strSearch'].str.split(' ')
             ch_md = ch_md.explode('strSearch')
-            ch_md = ch_md[ch_md['strSearch'].isin(metadata[filter_title]['strSearch'])]
+            ch_md = ch_md[pd.MultiIndex.from_frame(ch_md[['title_id', 'strSearch']]).isin(titles)]
             
             if len(ch_md.index) != 0:
                 metadata = pd.concat([metadata, ch_md], ignore_index=True)
                 filter_title = (metadata['category'] == 'WORK_OF_ART')
  
         # flag if title of movie equals character or principal name
-        conflicts = metadata[~filter_title][metadata[~filter_title]['strSearch'].isin(metadata[filter_title]['strSearch'])]       
-        metadata['conflicts'] = metadata['strSearch'].isin(conflicts['strSearch'])
-        
-        # filter out first names
-        if not include_firstNames:
-            metadata = metadata[~(metadata['mdType'] == 'firstName')]
+        searches = pd.MultiIndex.from_frame(metadata[['title_id', 'strSearch']])
+        conflicts = searches[~filter_title & searches.isin(titles)]
+        metadata['conflicts'] = searches.isin(conflicts)
      
         # add regex escaped string
         metadata['strSearchEscaped'] = metadata['strSearch'].str.replace(r'([\]\[\(\)\?\*\+\.\$])', r'\\\1', regex=True)     
   
         # start replacement with longest strings, to avoid, e.g., replacing only the last name
         metadata['lenSearch'] = metadata['strSearch'].str.len()
-        metadata = metadata.sort_values(by=['lenSearch', 'category'], ascending=[False, False])
+        metadata = metadata.sort_values(by=['title_id', 'lenSearch', 'category'], ascending=[True, False, False], kind='stable')
+        metadata['ordinal'] = metadata.groupby('title_id').cumcount()
         
         return metadata
 
@@ -885,6 +1422,21 @@ class DB:
             
         genre_filter = '' if genre_id is None or genre_id < 1 else f'WHERE r.genre_flag & (1 << {genre_id}) != 0'
         
+        with closing(self.connection()) as conn:
+            has_fts = self._has_table(conn, 'sentence_fts')
+        
+        if has_fts:
+            # look up the sentences containing each term as phrase of tokens in the full-text index
+            term_sentences = '''FROM aspect_words w
+                                  INNER JOIN sentence_fts
+                                  ON sentence_fts MATCH '"' || REPLACE(w.term, '"', '""') || '"'
+                                  INNER JOIN [review_sentence] s
+                                  ON s.id = sentence_fts.rowid'''
+        else:
+            term_sentences = """FROM [review_sentence] s
+                                  INNER JOIN aspect_words w
+                                  ON s.sentence LIKE '% ' || w.term || ' %'"""
+        
         return pd.read_sql_query(f'''WITH all_terms AS
                                 (
                                   SELECT s.id, w.aspect_id,
@@ -893,11 +1445,9 @@ class DB:
                                          WHEN s.polComp BETWEEN -0.2 AND 0.2 THEN 3
                                          WHEN s.polComp BETWEEN -0.6 AND -0.2 THEN 2
                                          ELSE 1 END AS polarity
-                                  FROM [review_sentence] s
+                                  {term_sentences}
                                   INNER JOIN review r
                                   ON s.review_id = r.id
-                                  INNER JOIN aspect_words w
-                                  ON s.sentence LIKE '% ' || w.term || ' %'
                                   {genre_filter}
                                 ),
                                 sentences AS
@@ -922,44 +1472,29 @@ class DB:
           , make sure to set 'verified' = 1 for gold aspects only
         """
         
-        annotations.to_sql(con=self.connection(), name='import_annotations', if_exists='replace')
-    
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:            
 
-                cmd.execute('''PRAGMA foreign_keys = ON;''')
-                
-                cmd.execute('''INSERT OR IGNORE INTO [sentence_aspect]
-                                   ([sentence_id]
-                                   ,[aspect_id]
-                                   ,[aspect_term]
-                                   ,[ordinal]
-                                   ,[sentiment_term]
-                                   ,[polarity]
-                                   ,[verified])
-                            SELECT i.[id]
-                                  ,a.[id]
-                                  ,i.[aspect_term]
-                                  ,i.[ordinal]
-                                  ,i.[sentiment_term]
-                                  ,i.[polarity]
-                                  ,i.[verified]
-                              FROM [import_annotations] i
-                            INNER JOIN aspect a
-                             ON a.category = i.category
-                            WHERE NOT EXISTS (SELECT * FROM sentence_aspect sa
-                                               WHERE sa.sentence_id = i.[id]
-                                                 AND sa.aspect_id = a.[id]
-                                                 AND sa.aspect_term = i.aspect_term
-                                                 AND sa.ordinal = i.ordinal
-                                                 AND sa.verified = i.verified)
-                            ''')
-                
-                conn.commit()   
-                
-                cmd.execute('''DROP TABLE import_annotations''')
-                
-                conn.commit()
+            conn.execute('''PRAGMA foreign_keys = ON;''')
+            
+            # categories without aspect are dropped
+            aspect_ids = dict(conn.execute('''SELECT category, id FROM aspect''').fetchall())
+            
+            annotations = annotations[annotations['category'].isin(aspect_ids)]
+            
+            # (existing aspects are ignored by the unique index)
+            self._bulk_write(conn, 'sentence_aspect', '''INSERT OR IGNORE INTO [sentence_aspect]
+                                                            ([sentence_id]
+                                                            ,[aspect_id]
+                                                            ,[aspect_term]
+                                                            ,[ordinal]
+                                                            ,[sentiment_term]
+                                                            ,[polarity]
+                                                            ,[verified])
+                                                          VALUES(?, ?, ?, ?, ?, ?, ?)'''
+                            , zip(annotations['id'].tolist(), annotations['category'].map(aspect_ids).tolist(), annotations['aspect_term'].tolist()
+                                 ,annotations['ordinal'].tolist(), annotations['sentiment_term'].tolist(), annotations['polarity'].tolist(), annotations['verified'].tolist()))
+            
+            conn.commit()
     
     
     def get_absa_dataset(self, genre_id, target_amount_per_aspect=150, train_split=0.85):
@@ -970,6 +1505,8 @@ class DB:
             train_split: desired ratio of samples in train vs eval, per aspect
             
                 - Note that these are not guaranteed, because the final selection is made per sentence -
+                
+            The selection only depends on the annotations, i.e., the same dataset is returned for the same annotations.
         
         Returns data in SetFit format:
         
@@ -982,6 +1519,7 @@ class DB:
         """
     
         # get aspect categories, start with the underrepresented
+        # and all verified aspects of sentences in the genre at once
         with closing(self.connection()) as conn:
             with closing(conn.cursor()) as cmd:
             
@@ -990,83 +1528,77 @@ class DB:
                                             WHERE verified = 1
                                               AND aspect_id IS NOT NULL
                                             GROUP BY [aspect_id]
-                                            ORDER BY COUNT(*)
+                                            ORDER BY COUNT(*), [aspect_id]
                                          ''').fetchall()
    
+            aspects = pd.read_sql_query(f'''SELECT s.id
+                                                ,s.sentence AS text
+                                                ,sa.aspect_term AS span
+                                                ,sa.polarity AS label
+                                                ,sa.ordinal
+                                                ,sa.aspect_id
+                                            FROM review_sentence s
+                                            INNER JOIN sentence_aspect sa
+                                             ON s.id = sa.sentence_id
+                                            INNER JOIN review r
+                                             ON s.review_id = r.id
+                                            WHERE sa.verified = 1
+                                              AND r.genre_flag & (1 << {genre_id}) != 0
+                                            ORDER BY s.id, sa.id
+                                         ''', conn)
+        
+        # position of each sentence in the (sorted) sentence ids
+        sentence_nr, sentence_ids = pd.factorize(aspects['id'], sort=True)
         
-        dataset = None
-        for aspect_id in aspect_ids:
+        # per sentence: step of the selection, i.e., the index of the aspect it was selected for (-1 = not selected)
+        # , and whether it belongs to the train dataset
+        step = np.full(len(sentence_ids), -1)
+        train = np.zeros(len(sentence_ids), dtype=bool)
         
-            current_aspect_count = 0
-            sentences = []
+        # get iid samples per aspect & polarity, split by ratio
+        # ---
+        # the selection is rather complicated, because
+        # a)
+        # even though, we are filtering by aspect
+        # all aspects for a given sentence have to be selected
+        # to properly set the negative aspect list of the AbsaTrainer
+        # b)
+        # similarly, the split between 'train' and 'eval' dataset
+        # has to be made per sentence, not aspect
+        for i, (aspect_id,) in enumerate(aspect_ids):
+        
+            is_aspect = (aspects['aspect_id'] == aspect_id).to_numpy()
+            selected = step[sentence_nr] != -1
             
-            if dataset is not None:
-                current_aspect_count = len(dataset[dataset['aspect_id'] == aspect_id[0]])
-                sentences = dataset['id'].to_list()
-                
-            while len(sentences) < 2:
-                # hack to conform python tuple() representation to sql
-                sentences.append(0)
-                
-            # get iid samples per aspect & polarity, split by ratio
-            # ---
-            # the selection is rather complicated, because
-            # a)
-            # even though, we are filtering by aspect
-            # all aspects for a given sentence have to be selected
-            # to properly set the negative aspect list of the AbsaTrainer
-            # b)
-            # similarly, the split between 'train' and 'eval' dataset
-            # has to be made per sentence, not aspect
-            df = pd.read_sql_query(f'''WITH all_sentences AS
-                                      (
-                                          SELECT s.id, sa.polarity
-                                          FROM review_sentence s
-                                          INNER JOIN sentence_aspect sa
-                                           ON s.id = sa.sentence_id
-                                          INNER JOIN review r
-                                           ON s.review_id = r.id
-                                          WHERE sa.aspect_id = {aspect_id[0]}
-                                            AND sa.verified = 1
-                                            AND s.id NOT IN {tuple(sentences)}
-                                            AND r.genre_flag & (1 << {genre_id}) != 0
-                                      )
-                                      , polarities AS
-                                      (
-                                       SELECT {target_amount_per_aspect - current_aspect_count} / COUNT(DISTINCT polarity) as max_count
-                                       FROM all_sentences
-                                      )
-                                      , sentences AS
-                                      (
-                                        SELECT id, DENSE_RANK() OVER (ORDER BY id) AS nr
-                                        FROM (SELECT id, DENSE_RANK() OVER (
-                                                         PARTITION BY polarity 
-                                                         ORDER BY id ASC) AS AspectNum
-                                              FROM all_sentences)
-                                        WHERE AspectNum < (SELECT max_count FROM polarities)
-                                      )
+            current_aspect_count = np.count_nonzero(is_aspect & selected)
+        
+            # distinct sentences per polarity, by sentence id
+            candidates = pd.DataFrame({'nr': sentence_nr[is_aspect & ~selected]
+                                      ,'label': aspects['label'].to_numpy()[is_aspect & ~selected]}).drop_duplicates()
                                       
-                                      SELECT DISTINCT s.id
-                                          ,s.sentence AS text
-                                          ,sa.aspect_term AS span
-                                          ,sa.polarity AS label
-                                          ,sa.ordinal
-                                          ,CASE WHEN sentences.nr < (SELECT MAX(nr) * {train_split} FROM sentences)
-                                                THEN 'train' ELSE 'eval' END as dataset
-                                      FROM sentences
-                                      INNER JOIN review_sentence s
-                                       ON sentences.id = s.id
-                                      INNER JOIN sentence_aspect sa
-                                       ON sa.sentence_id = s.id
-                                      WHERE sa.verified = 1
-                                    ''', self.connection())
-                       
-            if dataset is None:
-                dataset = df
-            else:
-                dataset = pd.concat([dataset,df], ignore_index=True)
+            if len(candidates.index) == 0:
+                continue
+            
+            max_count = int((target_amount_per_aspect - current_aspect_count) / candidates['label'].nunique())
+            
+            candidates = candidates.sort_values('nr', kind='stable')
+            
+            chosen = np.unique(candidates.loc[candidates.groupby('label', dropna=False).cumcount() + 1 < max_count, 'nr'].to_numpy())
+            
+            step[chosen] = i
+            train[chosen] = np.arange(1, len(chosen) + 1) < len(chosen) * train_split
+            
+            
+        selected = step[sentence_nr] != -1
+        
+        dataset = aspects.loc[selected, ['id', 'text', 'span', 'label', 'ordinal']]
+        
+        dataset['dataset'] = np.where(train[sentence_nr[selected]], 'train', 'eval')
         
-        return dataset
+        # in order of selection, then by sentence
+        dataset = dataset.iloc[np.argsort(step[sentence_nr[selected]], kind='stable')]
+        
+        return dataset.drop_duplicates().reset_index(drop=True)
 
     def get_aspect_terms(self):
         """ get aspect terms """
@@ -1096,6 +1628,9 @@ class DB:
                     cmd.execute('''DELETE FROM [sentence_aspect]
                                    WHERE verified = 0
                                 ''')
+                    
+                    if self._has_table(conn, 'review_features'):
+                        cmd.execute('''DELETE FROM [review_features]''')
                 
                 else:
                 
@@ -1114,12 +1649,63 @@ class DB:
                                                      WHERE genre_flag & (1 << {genre_id}) != 0)
                                 ''')
                 
+                    if self._has_table(conn, 'review_features'):
+                        cmd.execute(f'''DELETE FROM [review_features]
+                                       WHERE review_id IN (SELECT id FROM review WHERE genre_flag & (1 << {genre_id}) != 0)
+                                    ''')
+                
                 conn.commit()
                              
   
-    def get_sentences_for_prediction(self, genre_id = None, chunk_size = None):
+    def get_heldout_sentences(self, limit, genre_id = None):
+        """ get a fixed sample of sentences without gold aspects (i.e., not used for training)
+            optionally filtered by genre_id
+        """
+        
+        genre_filter = '' if genre_id is None or genre_id < 1 else f'AND r.genre_flag & (1 << {genre_id}) != 0'
+        
+        # multiplicative hash of the id, to get the same spread sample on every call
+        return pd.read_sql_query(f'''SELECT s.id, s.[sentence] as text
+                                      FROM [review_sentence] s
+                                      INNER JOIN review r
+                                      ON s.review_id = r.id
+                                      WHERE NOT EXISTS (SELECT 1 FROM sentence_aspect sa
+                                                         WHERE sa.sentence_id = s.id
+                                                           AND sa.verified = 1)
+                                      {genre_filter}
+                                      ORDER BY (s.id * 2654435761) % 4294967296
+                                      LIMIT {limit}
+                                 ''', self.connection()) 
+  
+    def get_sentence_ranges_for_prediction(self, genre_id = None, chunk_size = None):
+        """ get id ranges of sentences, that have not been analyzed yet,
+            with chunk_size sentences (belonging to a given genre) each
+          
+          Returns:
+            list of (first id, last id)
+        """
+        
+        if chunk_size is None:
+            chunk_size = 10000
+        
+        genre_filter = '' if genre_id is None or genre_id < 1 else f'AND r.genre_flag & (1 << {genre_id}) != 0'
+        
+        ids = pd.read_sql_query(f'''SELECT s.id
+                                      FROM [review_sentence] s
+                                      INNER JOIN review r
+                                      ON s.review_id = r.id
+                                      WHERE analyzed = 0
+                                      {genre_filter}
+                                      ORDER BY s.id
+                                 ''', self.connection())['id'].to_numpy()
+        
+        return [(int(ids[i]), int(ids[min(i + chunk_size, len(ids)) - 1])) for i in range(0, len(ids), chunk_size)]
+  
+    def get_sentences_for_prediction(self, genre_id = None, chunk_size = None, after_id = None, until_id = None):
         """ get sentences for reviews of titles (belonging to a given genre)
           , that have not been analyzed yet
+          , optionally only those with an id greater than after_id (to read ahead of updates)
+            and not greater than until_id
         """
         
         if chunk_size is None:
@@ -1127,6 +1713,12 @@ class DB:
         
         genre_filter = '' if genre_id is None or genre_id < 1 else f'AND r.genre_flag & (1 << {genre_id}) != 0'
         
+        if after_id is not None:
+            genre_filter = f'{genre_filter} AND s.id > {after_id}'
+            
+        if until_id is not None:
+            genre_filter = f'{genre_filter} AND s.id <= {until_id}'
+        
         return pd.read_sql_query(f'''SELECT s.id, s.[sentence] as text
                                       FROM [review_sentence] s
                                       INNER JOIN review r
@@ -1137,6 +1729,46 @@ class DB:
                                       LIMIT {chunk_size}
                                  ''', self.connection()) 
   
+    def get_cached_predictions(self, sentence_hashes, model_id):
+        """ get cached aspect predictions
+        
+          Arguments:
+            sentence_hashes: hashes of sentence texts, see nlp.sentence_hash
+            model_id: id of the setfit models, see nlp.setfit_model_id
+            
+          Returns:
+            dict of sentence_hash: list of (aspect_term, ordinal, context, polarity)
+        """
+        
+        predictions = {}
+        sentence_hashes = list(sentence_hashes)
+        
+        with closing(self.connection()) as conn:
+            # (in batches, to stay below the sqlite limit of query parameters)
+            for start in range(0, len(sentence_hashes), 900):
+                hashes = sentence_hashes[start:start + 900]
+                
+                rows = conn.execute(f'''SELECT sentence_hash, aspects
+                                        FROM absa_prediction
+                                        WHERE model_id = ?
+                                          AND sentence_hash IN ({','.join('?' * len(hashes))})
+                                     ''', [model_id, *hashes]).fetchall()
+                
+                predictions.update({sentence_hash: [tuple(aspect) for aspect in json.loads(aspects)] for sentence_hash, aspects in rows})
+        
+        return predictions
+    
+    def cache_predictions(self, predictions, model_id):
+        """ save aspect predictions, see get_cached_predictions """
+        
+        with closing(self.connection()) as conn:
+        
+            conn.executemany('''INSERT OR REPLACE INTO absa_prediction(sentence_hash, model_id, aspects)
+                                VALUES(?, ?, ?)'''
+                            , ((sentence_hash, model_id, json.dumps(aspects)) for sentence_hash, aspects in predictions.items()))
+            
+            conn.commit()
+  
     def update_sentences_analyzed(self, ids):
         """ mark sentences as analyzed / aspects predicted """
  
@@ -1151,12 +1783,147 @@ class DB:
                                 SET analyzed = 1
                                 WHERE id IN {tuple(ids)}''')
                 
+                self._update_review_features(conn, ids)
+                
                 conn.commit()    
     
+    def _review_feature_columns(self, conn):
+        """ returns list of (column, type, aggregate) for the features of a review, see get_review_polarities_sparse """
+        
+        aspects = [row[0] for row in conn.execute('SELECT [category] FROM aspect ORDER BY [category]').fetchall()]
+        polarities = ['very negative', 'negative', 'neutral', 'positive', 'very positive'] #TODO: make config
+
+        aspect_polarity_combinations = list(itertools.product(aspects, polarities))
+        
+        aspects.append('None')
+        aspect_polarity_combinations.append(('None', 'none'))
+        
+        columns = [('mean_review_polarity', 'REAL', 'AVG(s.polComp)')]
+
+        # count of appearance of aspect / polarity combination
+        # i.e., 0, 1, .. , 9, 10, ..
+        # note that these features are purposely _not_ normalized, as they should have a heigher weight then the rest
+        columns += [(f"{combo[0]}_{combo[1].replace(' ','_')}", 'INTEGER'
+                    ,f"SUM(CASE WHEN IFNULL(a.category, 'None') = '{combo[0]}' AND IFNULL(sa.polarity, 'none') = '{combo[1]}' THEN 1 ELSE 0 END)")
+                    for combo in aspect_polarity_combinations]
+
+        # averages of vader sentiment scores, for sentences containing a given aspect
+        # continuous value between -1 and 1
+        columns += [(f'{aspect}_mean', 'REAL'
+                    ,f"IFNULL(AVG(CASE WHEN IFNULL(a.category, 'None') = '{aspect}' THEN s.polComp END), 0)")
+                    for aspect in aspects]
+                    
+        return columns
+        
+    def _review_feature_genres(self, conn):
+        """ returns list of (genre_id, column) for the genre flags of a review, see get_review_polarities_sparse """
+        
+        # reduced to 'main' genres to appear in conjunction with setfit filtered genre
+        # TODO: make config / will be different set for different setfit model
+        return [(genre_id, f"genre_{name.replace('-','_')}")
+                for genre_id, name in conn.execute('SELECT [id], [displayName] FROM genre ORDER BY [id]').fetchall()
+                if name in ('Adventure', 'Comedy', 'Drama', 'Fantasy', 'Sci-Fi')]
+        
+    def _select_review_features(self, columns, review_filter = ''):
+        """ returns query aggregating analyzed sentences and their predicted aspects into the features of each review """
+        
+        return f'''SELECT s.review_id,
+                   {', '.join(f'{aggregate} AS {column}' for column, _, aggregate in columns)}
+                  FROM [review_sentence] s
+                  LEFT OUTER JOIN sentence_aspect sa
+                   ON sa.sentence_id = s.id
+                  AND sa.verified = 0
+                  LEFT OUTER JOIN aspect a
+                   ON a.id = sa.aspect_id
+                  WHERE s.analyzed = 1
+                  {review_filter}
+                  GROUP BY s.review_id
+               '''
+        
+    def _insert_review_features(self, conn, columns, review_ids = None):
+        """ aggregates analyzed sentences and their predicted aspects into review_features
+            for all reviews, or the given review ids
+        """
+        
+        review_filter = '' if review_ids is None else f"AND s.review_id IN ({','.join('?' * len(review_ids))})"
+        
+        conn.execute(f'''INSERT INTO review_features
+                          (review_id, {', '.join(column for column, _, _ in columns)})
+                         {self._select_review_features(columns, review_filter)}
+                      ''', [] if review_ids is None else review_ids)
+    
+    def _has_review_features(self, conn, columns):
+        """ whether the review_features table exists with the given columns """
+        
+        existing = [row[1] for row in conn.execute('PRAGMA table_info(review_features)').fetchall()]
+        
+        return existing == ['review_id'] + [column for column, _, _ in columns]
+    
+    def _assure_review_features(self, conn):
+        """ creates and fills the review_features table
+            , or recreates it, if the aspect categories changed
+            (within the current transaction, i.e., commit afterwards)
+        
+          Returns:
+            list of (column, type, aggregate), see _review_feature_columns
+        """
+        
+        columns = self._review_feature_columns(conn)
+        
+        if not self._has_review_features(conn, columns):
+        
+            conn.execute('''DROP TABLE IF EXISTS review_features''')
+            
+            conn.execute(f'''CREATE TABLE review_features(
+                               review_id INTEGER PRIMARY KEY
+                              ,{' ,'.join(f'{column} {datatype} NOT NULL' if datatype == 'INTEGER' else f'{column} {datatype}' for column, datatype, _ in columns)}
+                              ,FOREIGN KEY(review_id) REFERENCES review(id) ON DELETE CASCADE
+                              )''')
+            
+            self._insert_review_features(conn, columns)
+            
+        return columns
+        
+    def _update_review_features(self, conn, sentence_ids):
+        """ recalculates the features of the reviews with the given sentences
+            (within the current transaction, i.e., commit afterwards)
+        """
+        
+        columns = self._review_feature_columns(conn)
+        
+        if not self._has_review_features(conn, columns):
+            # database not assured yet, aggregate all reviews (incl. the given sentences) once
+            self._assure_review_features(conn)
+            return
+        
+        review_ids = set()
+        
+        # (in batches, to stay below the sqlite limit of query parameters)
+        for start in range(0, len(sentence_ids), 900):
+            ids = sentence_ids[start:start + 900]
+            
+            review_ids.update(row[0] for row in conn.execute(f'''SELECT DISTINCT review_id FROM review_sentence
+                                                                WHERE id IN ({','.join('?' * len(ids))})
+                                                             ''', ids))
+        
+        review_ids = sorted(review_ids)
+        
+        for start in range(0, len(review_ids), 900):
+            ids = review_ids[start:start + 900]
+            
+            conn.execute(f'''DELETE FROM review_features
+                              WHERE review_id IN ({','.join('?' * len(ids))})
+                           ''', ids)
+                           
+            self._insert_review_features(conn, columns, ids)
+
     def get_review_polarities_sparse(self, review_id = None, genre_id = None, usage = None, ratings = None):
         """ get review polarities from analyzed sentences
             with separate discrete valued columns for each aspect category / polarity combination
             
+            (the aggregated features are read from the review_features table,
+             which is created by assure_database and kept up to date by update_sentences_analyzed and reset_predictions)
+            
         Filter:
             review_id: int - get polarities for a specific review
             genre_id: int - get polarities for all reviews pertaining to a movie of the given genre
@@ -1165,42 +1932,23 @@ class DB:
         """
         
         with closing(self.connection()) as conn:
-            with closing(conn.cursor()) as cmd:  
             
-                genres = cmd.execute('SELECT [id], [displayName] FROM genre ORDER BY [id]').fetchall()
+            genres = self._review_feature_genres(conn)
             
-                aspects = cmd.execute('SELECT [category] FROM aspect ORDER BY [category]').fetchall()
-        
-        aspects = [item for l in aspects for item in l]
-        polarities = ['very negative', 'negative', 'neutral', 'positive', 'very positive'] #TODO: make config
-
-        aspect_polarity_combinations = list(itertools.product(aspects, polarities))
-        
-        aspects.append('None')
-        aspect_polarity_combinations.append(('None', 'none'))
+            columns = self._review_feature_columns(conn)
+            
+            features = 'review_features'
+            
+            if not self._has_review_features(conn, columns):
+                # (read only, the table is created by assure_database)
+                logging.warning('Review features are not up to date, please run assure_database (e.g., in train_06_predict_aspect_polarities.py) to aggregate them once.')
+                features = f'({self._select_review_features(columns)})'
 
         # 1 or -1 for each genre of title
-        # reduced to 'main' genres to appear in conjunction with setfit filtered genre
-        # TODO: make config / will be different set for different setfit model
-        flags = [f"""CASE WHEN r.genre_flag & (1 << {genre[0]}) != 0 THEN 1 ELSE -1 END
-                      AS genre_{genre[1].replace('-','_')}
-                   """
-                  for genre in genres if genre[1] in ('Adventure', 'Comedy', 'Drama', 'Fantasy', 'Sci-Fi')]
-
-        # count of appearance of aspect / polarity combination
-        # i.e., 0, 1, .. , 9, 10, ..
-        # note that these features are purposely _not_ normalized, as they should have a heigher weight then the rest
-        counts = [f"""SUM(CASE WHEN IFNULL(a.category, 'None') = '{combo[0]}' AND IFNULL(sa.polarity, 'none') = '{combo[1]}' THEN 1 ELSE 0 END)
-                      AS {combo[0]}_{combo[1].replace(' ','_')}
+        flags = [f"""CASE WHEN r.genre_flag & (1 << {genre_id}) != 0 THEN 1 ELSE -1 END
+                      AS {column}
                    """
-                  for combo in aspect_polarity_combinations]
-
-        # averages of vader sentiment scores, for sentences containing a given aspect
-        # continuous value between -1 and 1
-        means = [f"""IFNULL(AVG(CASE WHEN IFNULL(a.category, 'None') = '{aspect}' THEN s.polComp END), 0)
-                      AS {aspect}_mean
-                   """
-                  for aspect in aspects]
+                  for genre_id, column in genres]
 
         # filter
         review_filter = '' if review_id is None else f'AND r.id = {review_id}'
@@ -1221,48 +1969,71 @@ class DB:
                    CAST((r.rating + 1) / 2 AS INTEGER) AS class,
                    CASE WHEN r.rating > 6 THEN 1 ELSE 0 END AS binary_class,
                   {', '.join(flags)},
-                   AVG(s.polComp) AS mean_review_polarity,
-                  {', '.join(counts)},
-                  {', '.join(means)}
-                  FROM review r
-                  INNER JOIN [review_sentence] s
-                   ON r.id = s.review_id
-                  LEFT OUTER JOIN sentence_aspect sa
-                   ON sa.sentence_id = s.id
-                  AND sa.verified = 0
-                  LEFT OUTER JOIN aspect a
-                   ON a.id = sa.aspect_id
-                  WHERE s.analyzed = 1
+                  {', '.join(f'f.{column}' for column, _, _ in columns)}
+                  FROM review r, {features} f
+                  WHERE f.review_id = r.id
                   {review_filter}
                   {genre_filter}
                   {usage_filter}
                   {ratings_filter}
-                  GROUP BY r.id, r.rating
+                  ORDER BY r.id
                 """
         
-        #set dtypes (mainly for get_review_polarities_input)
-        dtypes = {'mean_review_polarity':float}
-        for aspect in aspects:
-            dtypes[f'{aspect}_mean'] = float
+        #set dtypes
+        dtypes = {column: float for column, datatype, _ in columns if datatype == 'REAL'}
   
         return pd.read_sql_query(query, self.connection(), dtype=dtypes)
     
+    def get_review_sentence_aspects(self, review_ids):
+        """ get analyzed sentences of reviews with predicted aspects
+            (in the form used for NLP.predict_sentiments)
+        
+          Returns:
+            DataFrame with review_id, genres (list of genre names of the reviewed title),
+            sentence_id, compound, category and polarity (None for sentences without aspects)
+        """
+        
+        with closing(self.connection()) as conn:
+            genres = conn.execute('SELECT [id], [displayName] FROM genre ORDER BY [id]').fetchall()
+        
+        sentences = pd.read_sql_query(f'''SELECT r.id AS review_id
+                                                ,r.genre_flag
+                                                ,s.id AS sentence_id
+                                                ,s.polComp AS compound
+                                                ,a.category
+                                                ,sa.polarity
+                                            FROM review r
+                                            INNER JOIN [review_sentence] s
+                                             ON r.id = s.review_id
+                                            LEFT OUTER JOIN sentence_aspect sa
+                                             ON sa.sentence_id = s.id
+                                            AND sa.verified = 0
+                                            LEFT OUTER JOIN aspect a
+                                             ON a.id = sa.aspect_id
+                                            WHERE s.analyzed = 1
+                                              AND r.id IN ({','.join(str(int(review_id)) for review_id in review_ids)})
+                                            ORDER BY r.id, s.id
+                                      ''', self.connection())
+        
+        flags = {flag: [name for genre_id, name in genres if flag & (1 << genre_id) != 0] for flag in sentences['genre_flag'].unique()}
+        
+        sentences['genres'] = sentences['genre_flag'].map(flags)
+        
+        return sentences.drop(columns=['genre_flag'])
+    
     def get_review_polarities_input(self):
         """ returns DataFrame with one empty row, in same format as get_review_polarities_sparse
             to create input features for classifier
         """
         
-        features = self.get_review_polarities_sparse(review_id=-1)
-
-        features = features.iloc[:,features.columns.get_loc('binary_class') + 1:]
+        with closing(self.connection()) as conn:
+        
+            genres = self._review_feature_genres(conn)
+            
+            columns = self._review_feature_columns(conn)
 
         # set defaults
-        for column in features.columns.tolist():
-            if column.startswith('genre_'):
-                features.at[0, column] = -1
-            elif 'mean' in column:
-                features.at[0, column] = 0.0
-            else:
-                features.at[0, column] = 0
+        defaults = {column: -1 for _, column in genres}
+        defaults.update({column: 0.0 if datatype == 'REAL' else 0 for column, datatype, _ in columns})
                 
-        return features
\ No newline at end of file
+        return pd.DataFrame([defaults])
\ No newline at end of file
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+
+
+def context_hash(text):
+    """ returns a stable hash of a context text """
+
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class EmbeddingStore:
+    """ append-only store of sentence embeddings for one body model,
+        memory-mapped for reading
+
+        Files (in the store folder, named by a hash of the model id):
+          .json  - model id, dtype and dimension
+          .index - one context hash per line, in the order of the embeddings
+          .bin   - raw embeddings
+    """
+
+    def __init__(self, path, model_id, dtype='float16'):
+        """ open or create embedding store
+
+          Arguments:
+            path: folder to store embeddings in
+            model_id: id of the body model, embeddings of different models are kept apart
+            dtype: 'float16' or 'float32' (only applies to new stores)
+        """
+
+        os.makedirs(path, exist_ok=True)
+
+        name = os.path.join(path, hashlib.sha1(model_id.encode('utf-8')).hexdigest()[:16])
+
+        self._meta_file = f'{name}.json'
+        self._index_file = f'{name}.index'
+        self._data_file = f'{name}.bin'
+
+        self.model_id = model_id
+        self.dtype = np.dtype(dtype)
+        self.dim = None
+
+        self._index = {}
+        self._data = None
+
+        if os.path.isfile(self._meta_file):
+            with open(self._meta_file) as file:
+                meta = json.load(file)
+
+            if meta['dtype'] != self.dtype.name:
+                logging.warning(f"Embedding store for '{model_id}' uses {meta['dtype']} instead of {self.dtype.name}.")
+
+            self.dtype = np.dtype(meta['dtype'])
+            self.dim = meta['dim']
+
+            self._load()
+
+    def __len__(self):
+        return len(self._index)
+
+    def _load(self):
+        """ read index and map embeddings """
+
+        rows = os.path.getsize(self._data_file) // (self.dim * self.dtype.itemsize) if os.path.isfile(self._data_file) else 0
+
+        hashes = []
+        if os.path.isfile(self._index_file):
+            with open(self._index_file) as file:
+                hashes = file.read().split()
+
+        if len(hashes) != rows:
+            # interrupted while appending, only keep complete entries
+            rows = min(rows, len(hashes))
+            hashes = hashes[:rows]
+
+            with open(self._index_file, 'w') as file:
+                file.writelines(f'{h}\n' for h in hashes)
+
+            with open(self._data_file, 'ab') as file:
+                file.truncate(rows * self.dim * self.dtype.itemsize)
+
+        self._index = {h: row for row, h in enumerate(hashes)}
+        self._map()
+
+    def _map(self):
+
+        if len(self._index) == 0:
+            self._data = None
+        else:
+            self._data = np.memmap(self._data_file, dtype=self.dtype, mode='r', shape=(len(self._index), self.dim))
+
+    def missing(self, hashes):
+        """ returns unique hashes not contained in the store """
+
+        return [h for h in dict.fromkeys(hashes) if h not in self._index]
+
+    def add(self, hashes, embeddings):
+        """ append embeddings for new context hashes """
+
+        embeddings = np.asarray(embeddings)
+
+        if len(hashes) == 0:
+            return
+
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+
+            with open(self._meta_file, 'w') as file:
+                json.dump({'model_id': self.model_id, 'dtype': self.dtype.name, 'dim': self.dim}, file)
+
+        # write embeddings before the index, so an interruption leaves no index entry without data
+        with open(self._data_file, 'ab') as file:
+            file.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+
+        with open(self._index_file, 'a') as file:
+            file.writelines(f'{h}\n' for h in hashes)
+
+        for h in hashes:
+            self._index[h] = len(self._index)
+
+        self._map()
+
+    def get(self, hashes):
+        """ returns float32 embeddings for hashes, which all need to be contained """
+
+        return self._data[[self._index[h] for h in hashes]].astype(np.float32)
+
+
+def attach_embedding_store(model_body, store):
+    """ makes a SentenceTransformer look up embeddings in the store,
+        and only encode (and store) contexts it has not seen before
+
+        (only attach to bodies which are not fine-tuned anymore)
+    """
+
+    encode = model_body.encode
+
+    def encode_stored(sentences, batch_size=32, show_progress_bar=None, convert_to_numpy=True, convert_to_tensor=False, normalize_embeddings=False, **kwargs):
+
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+
+        hashes = [context_hash(text) for text in texts]
+
+        missing = store.missing(hashes)
+        if len(missing) != 0:
+            texts_by_hash = dict(zip(hashes, texts))
+            store.add(missing, encode([texts_by_hash[h] for h in missing], batch_size=batch_size, show_progress_bar=show_progress_bar
+                                     , convert_to_numpy=True, normalize_embeddings=False, **kwargs))
+
+        embeddings = store.get(hashes) if len(hashes) != 0 else np.empty((0, store.dim or 0), dtype=np.float32)
+
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+        if convert_to_tensor:
+            import torch
+            embeddings = torch.from_numpy(embeddings).to(model_body.device)
+
+        return embeddings[0] if single else embeddings
+
+    # (kept for detach_embedding_store)
+    encode_stored.__wrapped__ = encode
+
+    model_body.encode = encode_stored
+
+    return model_body
+
+
+def detach_embedding_store(model_body):
+    """ makes a SentenceTransformer encode all contexts again, see attach_embedding_store
+        (e.g., before the body is changed, so stored embeddings don't fit it anymore)
+    """
+
+    encode = getattr(model_body.encode, '__wrapped__', None)
+
+    if encode is not None:
+        model_body.encode = encode
+
+    return model_body
@@ -0,0 +1,238 @@
+import re
+
+""" regex bounds for metadata replacement """
+SEARCH_PREFIX = '((?<=^)|(?<=[ \(\'"/]))'
+SEARCH_SUFFIX = '(?=[\.,;!\?\) \'"/]|$)'
+
+""" characters matched by the regex bounds """
+BOUNDARY_BEFORE = ' (\'"/'
+BOUNDARY_AFTER = '.,;!?) \'"/'
+
+""" relaxed regex bounds for finding candidates
+    (a parenthesized mention might be removed in front of or after another mention)
+"""
+CANDIDATE_PREFIX = '(?:(?<=^)|(?<=[ \(\'"/\)]))'
+CANDIDATE_SUFFIX = '(?=[\.,;!\?\) \'"/\(]|$)'
+
+""" order in which the forms of a mention are replaced """
+FORMS = ('quoted', 'parenthesized', 'nocase', 'case')
+
+MULTIPLE_SPACES = re.compile(r'  +')
+
+
+def trie_regex(strings):
+    """ returns a regex pattern matching any of the given strings
+       , structured as a trie, so that matching takes time linear to the length of the match
+       , instead of the number of strings (and longer strings are tried first)
+    """
+
+    trie = {}
+    for string in strings:
+        node = trie
+        for char in string:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    return _trie_pattern(trie)
+
+def _trie_pattern(node):
+
+    branches = [re.escape(char) + _trie_pattern(child) for char, child in node.items() if char != '']
+
+    if len(branches) == 0:
+        return ''
+
+    pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+
+    if '' in node:
+        # string might also end here
+        return f'(?:{pattern})?'
+
+    return pattern
+
+
+class MetadataMatcher:
+    """ finds all title, name and character mentions of an imdb title in one scan per text
+
+        (replaces the previous loop of up to three regex replacements per metadata entry)
+    """
+
+    def __init__(self, metadata):
+        """ build combined regex from metadata replacements
+
+          Arguments:
+            metadata: DataFrame from DB.get_metadata_replacements, sorted by priority
+        """
+
+        # words of all titles and names (incl. those skipped for replacement)
+        self.replaced_words = set()
+
+        # replacements for each form, keyed by search string
+        # (the first, i.e., longest, entry wins, if search strings are equal)
+        self._forms = {form: dict() for form in FORMS}
+
+        for rank, md in enumerate(metadata.itertuples(index=False)):
+
+            self.replaced_words.update(md.strSearch.upper().split())
+
+            if md.conflicts or md.ambiguous or len(md.strSearch) == 0:
+                # delay replacement until NER, if e.g., title equals character name
+                continue
+
+            strSearch_nocase = md.strSearch.lower()
+
+            self._forms['quoted'].setdefault(strSearch_nocase, (rank, md.strReplace))
+
+            # remove in parentheses
+            if md.category == 'PERSON':
+                self._forms['parenthesized'].setdefault(strSearch_nocase, (rank, ''))
+
+            # case-sensitive for single words
+            if ' ' in md.strSearch:
+                self._forms['nocase'].setdefault(strSearch_nocase, (rank, md.strReplace))
+            else:
+                self._forms['case'].setdefault(md.strSearch, (rank, md.strReplace))
+
+        if len(self._forms['quoted']) == 0:
+            self._regex = None
+            return
+
+        patterns = {form: trie_regex(strings) for form, strings in self._forms.items()}
+
+        alternatives = [rf"['\"](?P<quoted>(?i:{patterns['quoted']}))['\"]"]
+
+        if len(self._forms['parenthesized']) != 0:
+            alternatives.append(rf"\( ?(?P<parenthesized>(?i:{patterns['parenthesized']})) ?\)")
+
+        bare = []
+        if len(self._forms['nocase']) != 0:
+            bare.append(f"(?P<nocase>(?i:{patterns['nocase']}))")
+        if len(self._forms['case']) != 0:
+            bare.append(f"(?P<case>{patterns['case']})")
+
+        alternatives.append(f"{CANDIDATE_PREFIX}(?:{'|'.join(bare)}){CANDIDATE_SUFFIX}")
+
+        # lookahead to find (possibly overlapping) mentions at every position
+        self._regex = re.compile(f"(?=(?P<mention>{'|'.join(alternatives)}))")
+
+        self._groups = [(form_rank, form) for form_rank, form in enumerate(FORMS) if form in self._regex.groupindex]
+
+    def _lookup(self, form, strSearch):
+
+        return self._forms[form].get(strSearch if form == 'case' else strSearch.lower())
+
+    def _find_mentions(self, text):
+        """ returns list of (priority, start, end, replacement) for all mentions """
+
+        mentions = []
+
+        for match in self._regex.finditer(text):
+            for form_rank, form in self._groups:
+
+                strSearch = match.group(form)
+                if strSearch is None:
+                    continue
+
+                replacement = self._lookup(form, strSearch)
+                if replacement is not None:
+                    rank, strReplace = replacement
+                    mentions.append(((rank, form_rank), match.start(), match.end('mention'), strReplace))
+
+                if form_rank > 1:
+                    # shorter mentions at the same position, in case the longest one turns out to be unbounded
+                    start = match.start()
+                    for end in range(start + 1, match.end('mention')):
+                        if text[end] not in BOUNDARY_AFTER:
+                            continue
+
+                        strSearch = text[start:end]
+                        replacement = self._lookup('nocase', strSearch) if ' ' in strSearch else self._lookup('case', strSearch)
+                        if replacement is not None:
+                            rank, strReplace = replacement
+                            mentions.append(((rank, 2 if ' ' in strSearch else 3), start, end, strReplace))
+
+                break
+
+        return mentions
+
+    @staticmethod
+    def _bounded(text, start, end, accepted):
+        """ check if an unquoted mention is bounded, after replacing mentions of higher priority """
+
+        before = text[start-1:start]
+        after = text[end:end+1]
+
+        for a_start, a_end, strReplace in accepted:
+            if a_end == start:
+                before = strReplace[-1:] if strReplace else text[a_start-1:a_start]
+            elif a_start == end:
+                after = strReplace[:1] if strReplace else text[a_end:a_end+1]
+
+        return (before == '' or before in BOUNDARY_BEFORE) and (after == '' or after in BOUNDARY_AFTER)
+
+    def replace(self, text):
+        """ replace all mentions of title and names
+
+            overlapping mentions are resolved like consecutive replacements would,
+            i.e., the longest search string wins, and for the same string,
+            quoted before parenthesized before other mentions
+        """
+
+        if (self._regex is None) or not isinstance(text, str):
+            return text
+
+        mentions = self._find_mentions(text)
+
+        accepted = []
+        for (rank, form_rank), start, end, strReplace in sorted(mentions):
+            if all((end <= a_start) or (start >= a_end) for a_start, a_end, _ in accepted):
+                if form_rank < 2 or self._bounded(text, start, end, accepted):
+                    accepted.append((start, end, strReplace))
+
+        parts = []
+        position = 0
+        for start, end, strReplace in sorted(accepted):
+            parts.append(text[position:start])
+            parts.append(strReplace)
+            position = end
+        parts.append(text[position:])
+
+        #TODO: add s after possesive ', when principal name ends with s, e.g., "Reeves' performance" -> "the actor's performance"
+
+        return MULTIPLE_SPACES.sub(' ', ''.join(parts))
+
+
+def conflict_index(conflicts):
+    """ index of ambiguous or conflicting metadata, to resolve with NER labels
+
+      Arguments:
+        conflicts: ambiguous / conflicting rows from DB.get_metadata_replacements, sorted by priority
+
+      Returns:
+        dict of casefolded search string: (replacement by NER label, fallback)
+        , with fallback being None for ambiguous strings, else (search string, case sensitive, compiled regex, replacement)
+    """
+
+    index = {}
+
+    for strSearch, repl in conflicts.groupby('strSearch', sort=False):
+
+        strSearch_nocase = strSearch.casefold()
+        if strSearch_nocase in index:
+            continue
+
+        #TODO: currently the first entry from the matching category is taken, i.e., it doesn't handle one person having multiple jobs
+        labels = repl.drop_duplicates('category')
+        by_label = dict(zip(labels['category'], labels['strReplace']))
+
+        # if NER failed for title/name conflict, use title as fallback #TODO: make config
+        fallback = None
+        first = repl.iloc[0]
+        if not first['ambiguous']:
+            caseSensitive = not " " in strSearch
+            regex = re.compile(f'{SEARCH_PREFIX}{first["strSearchEscaped"]}{SEARCH_SUFFIX}', re.U if caseSensitive else re.I)
+            fallback = (strSearch if caseSensitive else strSearch_nocase, caseSensitive, regex, first['strReplace'])
+
+        index[strSearch_nocase] = (by_label, fallback)
+
+    return index
@@ -7,11 +7,26 @@ import nltk
 import spacy 
 import os
 import pickle
+import unicodedata
+import functools
+import hashlib
+import threading
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from re import _parser as sre_parse
+except ImportError: # python < 3.11
+    import sre_parse
 
 from spacy.language import Language
 from spacy.tokens.span import Span
 from nltk.sentiment.vader import SentimentIntensityAnalyzer
 
+from imdb_absa.aspects import AspectTermIndex
+from imdb_absa.metadata import SEARCH_PREFIX, SEARCH_SUFFIX, MetadataMatcher, conflict_index
+
 pd.options.mode.copy_on_write = True # to employ inplace replace
 
 """ regex to find emojis """
@@ -34,15 +49,111 @@ EMOJIS = re.compile(
 )
 
 
-""" regex bounds for metadata replacement """
-SEARCH_PREFIX = '((?<=^)|(?<=[ \(\'"/]))'
-SEARCH_SUFFIX = '(?=[\.,;!\?\) \'"/]|$)'
-
 """ abbreviations to replace conditionally """
 ABBREVIATIONS = [('OG','original')
                 ,('OMG','')
                 ,('LOL', '')]
 
+""" regex replacements to normalize reviews
+    (groups are applied in order, and within a group, a rule only applies
+     if its pattern matched the text as it was at the start of that group) """
+NORMALIZATIONS = [
+                  [(r'(([A-Z]\. )([A-Z]\. )+([A-Z]\.))', lambda a: a.group(0).replace(' ','')) #spaced abbreviations
+                  ]
+                 ,[(r'(https?://|www\.).*?(?=$|[\s\)\'"])', 'website') #url
+                  ,(r'([\s\(\'"])[^\s\(\'"]+\.(com|net|html?)(?=$|[\s\)\'"])', r'\1website') #TODO: Exclude websites in movie titles
+                  ,(r'(^|[\s\(])[#@][^\d\'" ].*?(?=$|[\s\)])', r'\1') #tags
+                  ,(r'([^\.,:;!\?]) ?\n ?([A-Z])', r'\1. \2') #new line missing full stop
+                  ,(r'([^\.,:;!\?]) ?\n ?[>-]+', r'\1. ') # bullet list
+                  ,(r'([\.,:;!\?]) ?\n ?[>-]+', r'\1 ')
+                  ,(r'([^\.,:;!\?]) ?\n ?[\d]{1,2}[\.\)]+(?!\d)', r'\1. ') # numbered list
+                  ,(r'([\.,:;!\?]) ?\n ?[\d]{1,2}[\.\)]+(?!\d)', r'\1 ')
+                  ,(r'^\.\.\.', '') #continuation from review title
+                  ,(r'\\', '/') # \
+                  ,(r'==+', ' ') # 'lines'
+                  ,(r'-{4,}', ' ')
+                  ,(r'\+{4,}', ' ')
+                  ,(r'\*{6,}', ' ')
+                  ,(r'\?[\?\.]+', '?') # multiples
+                  ,(r'![!\.]+', '!')
+                  ,(r',,+', ',')
+                  ,(r' ?\.( ?\. ?)+\.', '...')
+                  ,(EMOJIS, '. ')
+                  ,(r' ?[:;] ?[\)\|]+', '. ')
+                  ,(r' ?:[\(]+(?=$|[\s\.])', '. ')
+                  ,(r' \^[-_]?\^ ?', '. ')
+                  ,(r':?=\)', '')
+                  ,(r'(<\)|<3)', '')
+                  ,(r'\*(sigh|cough|yawn|rolls eyes)\*', ' ') #emotions
+                  ,(r'[Ff][*#@Uu-][*#@Cc-][*#@Kk]', 'f*ck') #censorship (to remove @ )
+                  ,(r'[Cc][Rr]@[Pp]', 'cr*p')
+                  ,(r'[Bb]@[Ll][Ll][Ss]', 'balls')
+                  ,(r'[Ss][Hh]@[Tt]', 'sh*t')
+                  ,(r'[”¨“]', '"') #unusual characters
+                  ,(r"(’|´|''|`|‘)", "'")
+                  ,(r'[★☆⭐]', '*')
+                  ,(r' @ ', ' at ')
+                  ,(r'\(=', '(')
+                  ]
+                 ,[(r'[_¡~\{\}><°♥﻿￼]', ' ') #unused characters (includes invisible characters!)
+                  ,(r'\n\(?website\)?$', '') #advertising
+                  ,(r'(^|[\s\(\'"])[a-zA-Z][a-zA-Z0-9]*@[a-zA-Z0-9]*(?=$|[\s\)\'"])', r'\1website')
+                  ,(r'(^|\s)[*\']([^\s\*]+?)[*\']($|[\.,:;\s!\?])', r'\1\2\3') # 'quotes' around single words
+                  ,(r'[\r\n\t\f\v]', ' ') #other white spaces
+                  ,(r'\( ?\d{4}[\!\? ]?\)', '') #info in parentheses
+                  ,(r'\(R\.I\.P\.\)', '')
+                  ,(r'[Tt][Ll];?[Dd][Rr](:| - )?', 'In summary, ')
+                  ,(r'([a-zA-Z])\(([a-zA-Z])\)', r'\1\2') # suffix letter(s)
+                  ,(r'\(([d-zD-Z])\)([a-zA-Z])', r'\1\2') # prefix (le)tters
+                  ,(r'\(([a-zA-Z]{2})\)([a-zA-Z])', r'\1\2')
+                  ]
+                 ,[(r'website website', 'website')
+                  ,(r',([a-zA-Z])', r', \1') #missing space
+                  ,(r'([a-z])\.([A-Z])', r'\1. \2')
+                  ,(r'\.\.\.([^ \)\'"])', r'... \1')
+                  ,(r';([^ ])', r'; \1')
+                  ,(r'([!\?])([^!\?\)\'" ])', r'\1 \2')
+                  ,(r'([^ ])(\()', r'\1 \2')
+                  ,(r'(\)[,:;\.]?)([^ ,:;\.])', r'\1 \2')
+                  ,(r'(\D:)([^ ])', r'\1 \2')
+                  ,(r'([eE]\.g\.|[iI]\.e\.)[ :]', r'\1, ') #missing comma
+                  ,(r'(etc\.) ([a-z])', r'\1, \2')
+                  ,(r' ?--+ ?', ', ')
+                  ,(r' Im ', " I'm ") # common misspellings
+                  ,(r' isnt ', " isn't ")
+                  ,(r' arnt ', " are not ")
+                  ,(r' didnt ', " didn't ")
+                  ,(r' back ground ', ' background ')
+                  ,(r'[Mm]ake-[Uu]p', 'makeup')
+                  ,(r'[Ss]low-[Mm]o(tion)?', 'slow motion')
+                  ,(r'[Ss](cript|creen)( -)?[Ww]riter', 'writer')
+                  ,(r'master piece', 'masterpiece')
+                  ,(r' alround ', ' all-round ')
+                  ,(r'[Cc]a?pt\.', 'Captain') # abbreviations
+                  ,(r'Dr\.', 'Doctor')
+                  ,(r'Mr\.', 'Mister')
+                  ,(r'Mr?s\.', 'Lady')
+                  ,(r'[Cc]\.[Gg]\.[Ii]\.?', 'CGI')
+                  ,(r'([ \(\'":])[Vv]ol\. ?', r'\1Volume ')
+                  ,(r'R\.I\.P\.(?!D\.)', 'farewell,')
+                  ,(r'[\., ]+b/c ', ', because ')
+                  ,(r'( |\()w/ ', r'\1with ')
+                  ,(r'( |\()w/o ', r'\1without ')
+                  ,(r' [Vv]/?[Ss]\.? ', ' versus ')
+                  ,(r'[Cc]ontd\.', 'continued')
+                  ,(r' [Nn][or]\. (?=\d)', ' number ')
+                  ,(r'appr\.', 'approximately')
+                  ,(r'( |\()pp\.', r'\1pages')
+                  ]
+                 ,[(r' -(?=[^ \d])', ' ') # random hyphen
+                  ,(r'(?<=[^ A-F])-( |$)', ' ')
+                  ,(r'\.?\.\. +([A-Z])', r'. \1') # unnecessary ellipsis
+                  ,(r'\. (\. )+', '. ') #extra white spaces
+                  ,(r' , ', ', ')
+                  ,(r'  +', ' ')
+                  ]
+                 ]
+
 """ word combinations to remove / reduce  """
 REPETITIONS_1 = [(r'director(\'s)? this movie','this movie')
                ,(r'(the|a|this) movie (the |this )?movie','this movie')
@@ -164,22 +275,441 @@ def ner_split_fix(doc):
 
     
 def get_aspect_categories(aspect, aspect_terms):
-    """ returns categories for a given aspect term """
+    """ returns categories for a given aspect term
+    
+      Arguments:
+        aspect: aspect context
+        aspect_terms: AspectTermIndex, or DataFrame from DB.get_aspect_terms (slower, as the index is built per call)
+    """
+
+    if not isinstance(aspect_terms, AspectTermIndex):
+        aspect_terms = AspectTermIndex(aspect_terms)
+        
+    return aspect_terms.categories(aspect)
+
 
-    terms = set()
-    categories = set()
+def sentence_hash(text):
+    """ returns a stable hash of a sentence, e.g., to key cached predictions """
 
-    for a in aspect_terms.itertuples(index=False):
-        if a.term in aspect and not any([a.term in term for term in terms]):
-            terms.add(a.term)
-            categories.add(a.category)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+def setfit_model_id(setfit_model):
+    """ returns an id for setfit absa models, which changes whenever local models are saved again,
+        or models from the hub are updated
+    """
+
+    mtimes = [os.path.getmtime(os.path.join(root, file))
+              for suffix in ('-aspect', '-polarity')
+              for root, _, files in os.walk(f'{setfit_model}{suffix}')
+              for file in files]
+
+    if len(mtimes) == 0:
+        # model from the hub, identified by the commit hashes of the snapshots in the huggingface cache
+        # (downloads the models, if they are not cached yet)
+        from huggingface_hub import snapshot_download
+        
+        try:
+            revisions = [os.path.basename(snapshot_download(f'{setfit_model}{suffix}')) for suffix in ('-aspect', '-polarity')]
+        except OSError as e:
+            logging.warning(f"Could not resolve the revision of '{setfit_model}', cached predictions and embeddings may be outdated: {e}")
+            return setfit_model
+        
+        return f"{setfit_model}@{'-'.join(revision[:12] for revision in revisions)}"
+
+    return f'{setfit_model}@{int(max(mtimes))}'
+
+def quantize_body(model_body):
+    """ replaces the linear layers of a sentence transformer with dynamically int8 quantized ones
+        (in place, CPU only)
+    """
+    
+    import torch
+    
+    model_body.to('cpu')
+    model_body.eval()
+    
+    torch.quantization.quantize_dynamic(model_body, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    
+    return model_body
 
-    if len(categories) > 1:
-        categories.discard('Overall')
-    elif len(categories) == 0:
-        categories.add('Other')
+def build_features(reviews, features):
+    """ fills classifier inputs for many reviews, in the column layout of DB.get_review_polarities_sparse
+    
+      Arguments:
+        reviews: list of (genres, sentences, aspects) for each review,
+                 with genres of the reviewed title, DataFrame of sentences with estimated polarities,
+                 and list of aspects with polarity label and categories for each sentence
+        features: DataFrame from DB.get_review_polarities_input, with default values
+        
+      Returns:
+        numpy matrix with one row of features per review
+        DataFrame with mean compound and polarity value per review and aspect category
+    """
+    
+    columns = {column: i for i, column in enumerate(features.columns)}
+    
+    X = np.tile(features.values[0].astype(np.float64), (len(reviews), 1))
+    
+    rows = []
+    
+    for row, (genres, sentences, aspects) in enumerate(reviews):
+    
+        compounds = sentences['compound'].to_numpy(dtype=np.float64)
+    
+        #set review polarity
+        X[row, columns['mean_review_polarity']] = compounds.mean()
+        
+        #set genre 'flags'
+        for genre in genres:
+            column = columns.get(f"genre_{genre.replace('-','_')}")
+            if column is not None:
+                X[row, column] = 1
         
-    return categories
+        #set aspect 'count' features
+        for compound, doc_aspects in zip(compounds, aspects):
+        
+            pairs = [(category, aspect.label) for aspect in doc_aspects for category in aspect.categories] or [('None', 'none')]
+            
+            for category, label in pairs:
+            
+                column = columns.get(f"{category}_{label.replace(' ','_')}")
+                if column is not None:
+                    X[row, column] += 1
+                
+                rows.append((row, category, compound, POLARITY_MAPPING[label]))
+    
+    #set aspect 'mean' features, with one groupby for all reviews
+    means = pd.DataFrame(rows, columns=['review', 'aspect', 'compound', 'polarity_value'])
+    
+    means = means.groupby(by=['review', 'aspect'])[['compound','polarity_value']].mean().reset_index()
+    
+    mean_columns = means['aspect'].map(lambda aspect: columns.get(f'{aspect}_mean', -1)).to_numpy()
+    known = mean_columns != -1
+    
+    X[means['review'].to_numpy()[known], mean_columns[known]] = means['compound'].to_numpy()[known]
+    
+    return X, means
+
+def length_batches(lengths, token_budget):
+    """ groups sentences of similar length into batches, to reduce padding
+    
+      Arguments:
+        lengths: token count for each sentence
+        token_budget: max. number of (padded) tokens per batch,
+                      i.e., batch size times length of the longest sentence in the batch
+                      
+      Returns:
+        list of arrays with positions of the sentences in each batch
+    """
+    
+    lengths = np.maximum(np.asarray(lengths, dtype=np.int64), 1)
+    
+    # stable sort, so sentences of equal length stay in original order
+    order = np.argsort(lengths, kind='stable')
+    
+    batches = []
+    start = 0
+    for end in range(1, len(order) + 1):
+        # sorted ascending, so the last sentence is the longest in the batch
+        if end == len(order) or (end + 1 - start) * lengths[order[end]] > token_budget:
+            batches.append(order[start:end])
+            start = end
+    
+    return batches
+
+
+def _required_substrings(items):
+    """ returns candidates for substrings, of which at least one has to be contained
+        in any text matching the parsed regex items
+    """
+
+    candidates = []
+    literal = ''
+
+    for op, av in items:
+
+        if op is sre_parse.LITERAL:
+            literal += chr(av)
+            continue
+
+        if literal:
+            candidates.append((literal,))
+            literal = ''
+
+        if op is sre_parse.IN:
+            if all(o is sre_parse.LITERAL for o, _ in av):
+                candidates.append(tuple(chr(a) for _, a in av))
+        elif op is sre_parse.SUBPATTERN:
+            if not av[1]: # no inline flags
+                candidates.extend(_required_substrings(av[-1]))
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            if av[0] > 0:
+                candidates.extend(_required_substrings(av[2]))
+        elif op is sre_parse.BRANCH:
+            branches = [_prefilter(branch) for branch in av[1]]
+            if all(branches):
+                candidates.append(tuple(s for branch in branches for s in branch))
+
+    if literal:
+        candidates.append((literal,))
+
+    return candidates
+
+
+def _prefilter_rank(substrings):
+    """ prefers long substrings, then few special characters over letters & spaces """
+
+    if len(substrings) == 1 and len(substrings[0].strip(' ')) > 1:
+        return (2, len(substrings[0]))
+
+    if any(s.strip(' ') == '' for s in substrings):
+        return (-1, 0)
+
+    return (1 if all(not s.isalnum() for s in substrings) else 0, -len(substrings))
+
+
+def _prefilter(items):
+    """ returns best candidate of required substrings for parsed regex items, or None """
+
+    candidates = [c for c in _required_substrings(items) if _prefilter_rank(c)[0] >= 0 and len(c) <= 4]
+
+    if len(candidates) == 0:
+        return None
+
+    return max(candidates, key=_prefilter_rank)
+
+
+def compile_normalizations(normalizations=NORMALIZATIONS):
+    """ precompiles groups of normalization rules, keeping their order
+    
+        each rule gets a prefilter of substrings, of which one has to be in a text for the pattern to match
+        (checking these with 'in' is a lot faster than running the regex engine on every review)
+    """
+
+    compiled = []
+
+    for group in normalizations:
+        rules = []
+        for pattern, replacement in group:
+            regex = re.compile(pattern)
+            prefilter = None if regex.flags & re.IGNORECASE else _prefilter(sre_parse.parse(regex.pattern))
+            rules.append((regex, replacement, prefilter))
+        compiled.append(rules)
+
+    return compiled
+
+
+def normalize_review(text, normalizations, normalForm='NFKC'):
+    """ normalizes a single review with precompiled normalization rules
+       (same result as one pandas replace(regex=...) call per group)
+    """
+
+    if not isinstance(text, str):
+        return text
+
+    for group in normalizations:
+        
+        group_text = text
+        changed = False
+        
+        for regex, replacement, prefilter in group:
+            if (prefilter is not None) and not any(s in group_text for s in prefilter):
+                continue
+            if not changed:
+                text, count = regex.subn(replacement, text)
+                changed = count > 0
+            elif regex.search(group_text):
+                text = regex.sub(replacement, text)
+
+    return unicodedata.normalize(normalForm, text).strip()
+
+
+""" regex for sentence splitting """
+NUMBERED_LIST = re.compile(r'#?(\d){1,2}[\.\)]+')
+NUMBERED_PREFIX = re.compile(r'^(\d){1,2}[\.\)]+ ')
+INLINE_LIST_DOT = re.compile(r'(?<! is)(?<! the)(?<! of)(?<! Volume) (\d)\. ')
+INLINE_LIST_PARENTHESIS = re.compile(r' \d\) ')
+INLINE_PARENTHESIS = re.compile(r'\(.* \d\) ')
+UPPERCASE_START = re.compile(r'[A-Z]')
+PUNCTUATION_START = re.compile(r'[\'"]?[\.,:;!\?\)]')
+SCREWED_PUNCTUATION = re.compile(r'[\.;](?=[ a-dfh-zA-Z])')
+
+NONE_SENTENCES_SET = frozenset(NONE_SENTENCES)
+
+
+def split_review(text, sent_detector):
+    """ splits a single review into sentences """
+
+    # sentences are collected as lists of parts, and only joined at the end
+    sentences = []
+    open_parentesis = False
+
+    def append_list(nr_list):
+        """ append items of an inline numbered list, join lowercase items with the previous sentence """
+        for sentence in nr_list:
+            if sentence == '':
+                continue
+
+            if (not sentences) or UPPERCASE_START.match(sentence):
+                sentences.append([sentence])
+            else:
+                last = sentences[-1]
+                if next(part for part in reversed(last) if part)[-1] not in '.,:;!?':
+                    last.append(',')
+                last.append(' ')
+                last.append(sentence)
+
+    for sentence in sent_detector.tokenize(text):
+
+        #clean up split sentences
+        if sentence in NONE_SENTENCES_SET:
+            continue
+        #numbered list 1.
+        if NUMBERED_LIST.fullmatch(sentence):
+            continue
+
+        sentence = NUMBERED_PREFIX.sub('', sentence)
+
+        #inline numbered list 2.
+        if INLINE_LIST_DOT.search(sentence):
+            nr_list = INLINE_LIST_DOT.split(sentence)
+            append_list(nr_list)
+            sentence = nr_list[-1]
+            open_parentesis = False
+        #inline numbered list 3)
+        elif (not open_parentesis) and INLINE_LIST_PARENTHESIS.search(sentence) and not INLINE_PARENTHESIS.search(sentence):
+            nr_list = INLINE_LIST_PARENTHESIS.split(sentence)
+            append_list(nr_list)
+            sentence = nr_list[-1]
+        #fix for nltk splitting sentences too freely, whenever there is a punctuation
+        elif sentences and (sentence.startswith("'s ") or PUNCTUATION_START.match(sentence)):
+            sentences[-1].append(sentence)
+            open_parentesis = False
+        #join short sentences, e.g., 'Yes.', 'Why?'
+        elif (not ' ' in sentence) and any(char.isalpha() for char in sentence):
+            if not sentences: #one-word review beginning
+                sentences.append([sentence])
+                open_parentesis = True
+                continue
+
+            sentences[-1].extend((' ', sentence))
+            open_parentesis = False
+        #greedily split sentences with screwed punctuation
+        elif len(sentence) > SENTENCE_MAXLENGTH:
+            sentences.extend([[f'{s.strip()}.'] for s in SCREWED_PUNCTUATION.split(sentence)])
+            open_parentesis = False
+        elif open_parentesis:
+            #TODO: consider more than two sentences in parentheses 
+            sentences[-1].extend((' ', sentence))
+            open_parentesis = False
+        else:
+            sentences.append([sentence])
+
+        #keep parentheses together
+        if ('(' in sentence) and (not ')' in sentence):
+            open_parentesis = True
+
+    return [''.join(sentence) for sentence in sentences]
+
+def split_reviews(texts, sent_detector):
+    """ splits a batch of reviews into sentences
+
+      Returns:
+        list with a list of sentences per review
+    """
+
+    return [split_review(text, sent_detector) for text in texts]
+
+
+""" number of sentences to memoize vader polarity scores for """
+POLARITY_CACHE_SIZE = 100000
+
+""" vader polarity scores, in the order of the returned columns """
+POLARITY_COLUMNS = ['neg', 'neu', 'pos', 'compound']
+
+
+def memoize_polarity(sia, maxsize=POLARITY_CACHE_SIZE):
+    """ returns vader scoring function with a bounded LRU cache
+        (many sentences repeat verbatim across reviews, e.g., "Highly recommended.")
+    """
+
+    @functools.lru_cache(maxsize=maxsize)
+    def polarity_scores(sentence):
+        scores = sia.polarity_scores(sentence)
+        return tuple(scores[column] for column in POLARITY_COLUMNS)
+
+    return polarity_scores
+
+def score_polarities(sentences, polarity_scores):
+    """ returns numpy array with a row of POLARITY_COLUMNS per sentence """
+
+    scores = np.empty((len(sentences), len(POLARITY_COLUMNS)))
+
+    for i, sentence in enumerate(sentences):
+        scores[i] = polarity_scores(sentence)
+
+    return scores
+
+
+""" models of worker processes for parallel preprocessing """
+_worker = {}
+
+def _init_worker():
+    """ loads regex & punkt models once per worker process """
+
+    _worker['normalizations'] = compile_normalizations()
+    _worker['sent_detector'] = nltk.PunktTokenizer()
+
+def _normalize_chunk(texts, normalForm):
+    return [normalize_review(text, _worker['normalizations'], normalForm) for text in texts]
+
+def _split_chunk(texts):
+    return split_reviews(texts, _worker['sent_detector'])
+
+def _polarity_chunk(texts):
+    # the memoized scorer lives as long as the worker, i.e. as long as NLP._worker_pool
+    if 'polarity_scores' not in _worker:
+        _worker['polarity_scores'] = memoize_polarity(SentimentIntensityAnalyzer())
+
+    return score_polarities(texts, _worker['polarity_scores']).tolist()
+
+
+def map_chunks(func, pdSeries, pool, chunk_size, *args):
+    """ applies func to chunks of a pandas Series in a pool of worker processes
+    
+        Arguments:
+            pool: ProcessPoolExecutor with _init_worker as initializer, see NLP._worker_pool
+    
+        Returns:
+            new pdSeries with results in the original order
+    """
+
+    values = pdSeries.tolist()
+    chunks = [values[i:i + chunk_size] for i in range(0, len(values), chunk_size)]
+
+    results = list(itertools.chain.from_iterable(pool.map(func, chunks, *[itertools.repeat(arg) for arg in args])))
+
+    return pd.Series(results, index=pdSeries.index, name=pdSeries.name, dtype=object)
+        
+
+class lazy_model:
+    """ decorator for loading a model on first access to the attribute
+        (thread-safe, the loaded model replaces the attribute)
+    """
+    
+    def __init__(self, load):
+        self._load = load
+        self._name = load.__name__
+        
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+            
+        with instance._load_lock:
+            if self._name not in instance.__dict__:
+                instance.__dict__[self._name] = self._load(instance)
+                
+        return instance.__dict__[self._name]
         
 
 class NLP:
@@ -188,8 +718,10 @@ class NLP:
     def __init__(self, spacy_model, spacy_exclude
                      , coref_model=None, coref_active=False
                      , setfit_model=None, setfit_active=False
-                     , clf_model=None, clf_active=False):
-        """ load nlp models
+                     , clf_model=None, clf_active=False
+                     , embedding_store=None, embedding_dtype='float16'
+                     , setfit_inference='fp32', setfit_threads=None):
+        """ set up nlp models, each is loaded on first use (or with warmup)
         
           Arguments:
             spacy_model: spacy model to use for NER & POS tags
@@ -200,52 +732,171 @@ class NLP:
             setfit_active: load setfit model (disable for preprocessing only)
             clf_model: local path to folder containing pickled SVC models
             clf_active: load classifier model (disable for preprocessing only)
+            embedding_store: folder to keep setfit embeddings of aspect contexts in (None to always encode)
+            embedding_dtype: 'float16' or 'float32' for stored embeddings
+            setfit_inference: 'fp32', or 'int8' to run the setfit bodies dynamically quantized on CPU
+            setfit_threads: number of intra-op threads for torch (None for torch default)
         """
 
-        # SBD
-        self._sent_detector = nltk.PunktTokenizer()
-
-        # NER
-        if spacy_model.endswith('trf'):
+        # normalization
+        self._normalizations = compile_normalizations()
+        
+        # all models are loaded on first use, see lazy_model
+        self._load_lock = threading.RLock()
+        
+        self._spacy_model = spacy_model
+        self._spacy_exclude = spacy_exclude
+        
+        self._coref = coref_active
+        self._coref_model = coref_model
+        
+        self._setfit_active = setfit_active
+        self._setfit_model = setfit_model
+        self._setfit_inference = setfit_inference
+        self._setfit_threads = setfit_threads
+        self._embedding_store = embedding_store
+        self._embedding_dtype = embedding_dtype
+        
+        if setfit_active:
+            self.setfit_model_id = setfit_model_id(setfit_model)
+            
+            if setfit_inference == 'int8':
+                # predictions differ slightly from the fp32 models
+                self.setfit_model_id = f'{self.setfit_model_id}+int8'
+                
+            elif setfit_inference != 'fp32':
+                logging.warning(f"Unknown setfit inference mode '{setfit_inference}', using fp32.")
+        
+        self._clf_active = clf_active
+        self._clf_model = clf_model
+        
+        # worker processes for parallel preprocessing, started on first use
+        self._pool = None
+        self._pool_workers = 0
+        
+        
+    def _worker_pool(self, workers):
+        """ returns the pool of worker processes for parallel preprocessing
+            (reused across calls, so the workers only load their models once)
+        """
+        
+        with self._load_lock:
+            if self._pool is not None and self._pool_workers != workers:
+                self._pool.shutdown()
+                self._pool = None
+                
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+                self._pool_workers = workers
+                
+        return self._pool
+        
+    def close(self):
+        """ stop the worker processes for parallel preprocessing """
+        
+        with self._load_lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+        
+        
+    # SBD
+    @lazy_model
+    def _sent_detector(self):
+        return nltk.PunktTokenizer()
+        
+    # NER
+    @lazy_model
+    def _nlp(self):
+        if self._spacy_model.endswith('trf'):
             spacy.prefer_gpu()
             
-        self._nlp = spacy.load(spacy_model, exclude=spacy_exclude)
-        self._nlp.add_pipe("ner_split_fix", after='ner')
+        nlp = spacy.load(self._spacy_model, exclude=self._spacy_exclude)
+        nlp.add_pipe("ner_split_fix", after='ner')
         
-        # SA
-        self._sia = SentimentIntensityAnalyzer()
-
-        # Coref
-        if coref_active:
-            self._coref = True
-            with warnings.catch_warnings():
-                warnings.simplefilter('ignore', UserWarning)
+        return nlp
+        
+    # SA
+    @lazy_model
+    def _sia(self):
+        return SentimentIntensityAnalyzer()
+        
+    @lazy_model
+    def _polarity_scores(self):
+        return memoize_polarity(self._sia)
+        
+    # Coref
+    @lazy_model
+    def _maverick(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', UserWarning)
+        
+            from maverick import Maverick
             
-                from maverick import Maverick
-                
-                self._maverick = Maverick(coref_model)
-        else:
-            self._coref = False
+            return Maverick(self._coref_model)
             
-        # Absa
-        if setfit_active:
+    # Absa
+    @lazy_model
+    def _setfit(self):
+        from setfit import AbsaModel
+        
+        setfit = AbsaModel.from_pretrained(f'{self._setfit_model}-aspect', f'{self._setfit_model}-polarity', spacy_model=self._nlp
+                                          ,spacy_disable_pipes=['ner','ner_split_fix'])
         
-            from setfit import AbsaModel
+        if self._setfit_threads is not None:
+            import torch
+            torch.set_num_threads(self._setfit_threads)
+        
+        if self._setfit_inference == 'int8':
+            quantize_body(setfit.aspect_model.model_body)
+            quantize_body(setfit.polarity_model.model_body)
+        
+        if self._embedding_store is not None:
+            self._attach_embedding_stores(setfit)
+            
+        return setfit
+        
+    def _attach_embedding_stores(self, setfit):
+        """ makes the setfit bodies look up embeddings in the stores of the current setfit_model_id """
+        
+        from imdb_absa.embeddings import EmbeddingStore, attach_embedding_store
+        
+        attach_embedding_store(setfit.aspect_model.model_body, EmbeddingStore(self._embedding_store, f'{self.setfit_model_id}-aspect', self._embedding_dtype))
+        attach_embedding_store(setfit.polarity_model.model_body, EmbeddingStore(self._embedding_store, f'{self.setfit_model_id}-polarity', self._embedding_dtype))
+   
+    # SVC
+    @lazy_model
+    def _clf_5(self):
+        # 1 to 5 stars classification
+        with open(os.path.join(self._clf_model, 'SVC_5.pkl'), 'rb') as f:
+            return pickle.load(f)
             
-            self._setfit = AbsaModel.from_pretrained(f'{setfit_model}-aspect', f'{setfit_model}-polarity', spacy_model=self._nlp
-                          ,spacy_disable_pipes=['ner','ner_split_fix'])
-       
-        # SVC
-        if clf_active:
+    @lazy_model
+    def _clf_2(self):
+        # binary classification
+        with open(os.path.join(self._clf_model, 'SVC_2.pkl'), 'rb') as f:
+            return pickle.load(f)
             
-            # 1 to 5 stars classification
-            with open(os.path.join(clf_model, 'SVC_5.pkl'), 'rb') as f:
-                self._clf_5 = pickle.load(f)
             
-            # binary classification
-            with open(os.path.join(clf_model, 'SVC_2.pkl'), 'rb') as f:
-                self._clf_2 = pickle.load(f)
-
+    def warmup(self):
+        """ load all active models and run a first inference with each,
+            to pay for initialization before the first actual request (e.g., in a background thread)
+        """
+        
+        self._sent_detector.tokenize('Warming up. Done.')
+        self._polarity_scores('Warming up.')
+        self._nlp('Warming up the model.')
+        
+        if self._coref:
+            self._maverick.predict([['Warming', 'up', '.'], ['It', 'is', 'done', '.']])
+        
+        if self._setfit_active:
+            self._setfit.predict_to_docs(['The acting was great.'])
+            
+        if self._clf_active:
+            self._clf_5
+            self._clf_2
+            
 
     def _check_name(self, name):
         doc = self._nlp(f'{name} once went to {name}.')
@@ -266,107 +917,20 @@ class NLP:
         return pdSeries.apply(self._check_name)
         
 
-    def normalize_reviews(self, pdSeries, normalForm = 'NFKC'):
+    def normalize_reviews(self, pdSeries, normalForm = 'NFKC', workers = 1, chunk_size = 1000):
         """ cleanup common review irregularities
           , make some replacements to facilitate tokenization
           , and normalize unicode characters
+          
+          Arguments:
+            workers: number of processes, to normalize chunks of reviews in parallel
+            chunk_size: number of reviews per chunk
         """
 
-        return pdSeries.str.replace(
-                                r'(([A-Z]\. )([A-Z]\. )+([A-Z]\.))', lambda a: a.group(0).replace(' ',''), regex=True #spaced abbreviations
-                                ).replace(regex={
-                                r'(https?://|www\.).*?(?=$|[\s\)\'"])':'website' #url
-                               ,r'([\s\(\'"])[^\s\(\'"]+\.(com|net|html?)(?=$|[\s\)\'"])':r'\1website' #TODO: Exclude websites in movie titles
-                               ,r'(^|[\s\(])[#@][^\d\'" ].*?(?=$|[\s\)])':r'\1' #tags
-                               ,r'([^\.,:;!\?]) ?\n ?([A-Z])':r'\1. \2' #new line missing full stop
-                               ,r'([^\.,:;!\?]) ?\n ?[>-]+':r'\1. ' # bullet list
-                               ,r'([\.,:;!\?]) ?\n ?[>-]+':r'\1 '
-                               ,r'([^\.,:;!\?]) ?\n ?[\d]{1,2}[\.\)]+(?!\d)':r'\1. ' # numbered list
-                               ,r'([\.,:;!\?]) ?\n ?[\d]{1,2}[\.\)]+(?!\d)':r'\1 '
-                               ,r'^\.\.\.':'' #continuation from review title
-                               ,r'\\':'/' # \
-                               ,r'==+':' ' # 'lines'
-                               ,r'-{4,}':' '
-                               ,r'\+{4,}':' '
-                               ,r'\*{6,}':' '
-                               ,r'\?[\?\.]+':'?' # multiples
-                               ,r'![!\.]+':'!'
-                               ,r',,+':','
-                               ,r' ?\.( ?\. ?)+\.':'...'
-                               ,EMOJIS:'. '
-                               ,r' ?[:;] ?[\)\|]+':'. '
-                               ,r' ?:[\(]+(?=$|[\s\.])':'. '
-                               ,r' \^[-_]?\^ ?':'. '
-                               ,r':?=\)':''
-                               ,r'(<\)|<3)':''
-                               ,r'\*(sigh|cough|yawn|rolls eyes)\*':' ' #emotions
-                               ,r'[Ff][*#@Uu-][*#@Cc-][*#@Kk]':'f*ck' #censorship (to remove @ )
-                               ,r'[Cc][Rr]@[Pp]':'cr*p'
-                               ,r'[Bb]@[Ll][Ll][Ss]':'balls'
-                               ,r'[Ss][Hh]@[Tt]':'sh*t'
-                               ,r'[”¨“]':'"' #unusual characters
-                               ,r"(’|´|''|`|‘)":"'"
-                               ,r'[★☆⭐]':'*'
-                               ,r' @ ':' at '
-                               ,r'\(=':'('
-                               }).replace(regex={
-                                r'[_¡~\{\}><°♥﻿￼]':' ' #unused characters (includes invisible characters!)
-                               ,r'\n\(?website\)?$':'' #advertising
-                               ,r'(^|[\s\(\'"])[a-zA-Z][a-zA-Z0-9]*@[a-zA-Z0-9]*(?=$|[\s\)\'"])':r'\1website'
-                               ,r'(^|\s)[*\']([^\s\*]+?)[*\']($|[\.,:;\s!\?])':r'\1\2\3' # 'quotes' around single words
-                               ,r'[\r\n\t\f\v]':' ' #other white spaces
-                               ,r'\( ?\d{4}[\!\? ]?\)':'' #info in parentheses
-                               ,r'\(R\.I\.P\.\)':''
-                               ,r'[Tt][Ll];?[Dd][Rr](:| - )?':'In summary, '
-                               ,r'([a-zA-Z])\(([a-zA-Z])\)':r'\1\2' # suffix letter(s)
-                               ,r'\(([d-zD-Z])\)([a-zA-Z])':r'\1\2' # prefix (le)tters
-                               ,r'\(([a-zA-Z]{2})\)([a-zA-Z])':r'\1\2'
-                               }).replace(regex={
-                                r'website website':'website'
-                               ,r',([a-zA-Z])':r', \1' #missing space
-                               ,r'([a-z])\.([A-Z])':r'\1. \2'
-                               ,r'\.\.\.([^ \)\'"])':r'... \1'
-                               ,r';([^ ])':r'; \1'
-                               ,r'([!\?])([^!\?\)\'" ])':r'\1 \2'
-                               ,r'([^ ])(\()':r'\1 \2'
-                               ,r'(\)[,:;\.]?)([^ ,:;\.])':r'\1 \2'
-                               ,r'(\D:)([^ ])':r'\1 \2'
-                               ,r'([eE]\.g\.|[iI]\.e\.)[ :]':r'\1, ' #missing comma
-                               ,r'(etc\.) ([a-z])':r'\1, \2'
-                               ,r' ?--+ ?':', '
-                               ,r' Im ':" I'm " # common misspellings
-                               ,r' isnt ':" isn't "
-                               ,r' arnt ':" are not "
-                               ,r' didnt ':" didn't "
-                               ,r' back ground ':' background '
-                               ,r'[Mm]ake-[Uu]p':'makeup'
-                               ,r'[Ss]low-[Mm]o(tion)?':'slow motion'
-                               ,r'[Ss](cript|creen)( -)?[Ww]riter':'writer'
-                               ,r'master piece':'masterpiece'
-                               ,r' alround ':' all-round '
-                               ,r'[Cc]a?pt\.':'Captain' # abbreviations
-                               ,r'Dr\.':'Doctor'
-                               ,r'Mr\.':'Mister'
-                               ,r'Mr?s\.':'Lady'
-                               ,r'[Cc]\.[Gg]\.[Ii]\.?':'CGI'
-                               ,r'([ \(\'":])[Vv]ol\. ?':r'\1Volume '
-                               ,r'R\.I\.P\.(?!D\.)':'farewell,'
-                               ,r'[\., ]+b/c ':', because '
-                               ,r'( |\()w/ ':r'\1with '
-                               ,r'( |\()w/o ':r'\1without '
-                               ,r' [Vv]/?[Ss]\.? ':' versus '
-                               ,r'[Cc]ontd\.':'continued'
-                               ,r' [Nn][or]\. (?=\d)':' number '
-                               ,r'appr\.':'approximately'
-                               ,r'( |\()pp\.':r'\1pages'
-                               }).replace(regex={
-                                r' -(?=[^ \d])':' ' # random hyphen
-                               ,r'(?<=[^ A-F])-( |$)':' '
-                               ,r'\.?\.\. +([A-Z])':r'. \1' # unnecessary ellipsis
-                               ,r'\. (\. )+':'. ' #extra white spaces
-                               ,r' , ':', '
-                               ,r'  +':' '
-                               }).str.normalize(normalForm).str.strip()
+        if workers > 1 and len(pdSeries.index) > chunk_size:
+            return map_chunks(_normalize_chunk, pdSeries, self._worker_pool(workers), chunk_size, normalForm)
+
+        return pdSeries.apply(normalize_review, normalizations=self._normalizations, normalForm=normalForm)
                                
                                
     def _replace_searchStr(self, pdSeries, strSearch, strReplace, replace_quotes, remove_parentheses, noCase=False):
@@ -387,26 +951,22 @@ class NLP:
         
         pdSeries = pdSeries.str.replace(f'{SEARCH_PREFIX}{strSearch}{SEARCH_SUFFIX}', strReplace, case=caseSensitive, regex=True)
 
-        #TODO: add s after possesive ', when principal name ends with s, e.g., "Reeves' performance" -> "the actor's performance"
-
         return pdSeries.str.replace(r'  +', ' ', regex=True)
 
-    def replace_metadata(self, pdSeries, metadata):
-        """ replace titles and names of principals """
+    def replace_metadata(self, pdSeries, metadata, matcher=None):
+        """ replace titles and names of principals
+        
+          Arguments:
+            metadata: imdb metadata from DB.get_metadata_replacements
+            matcher: MetadataMatcher for the same metadata (created if None)
+        """
 
-        replacedStrings = []
+        if matcher is None:
+            matcher = MetadataMatcher(metadata)
      
         # replace titles and names
-        # (this is done in a loop on purpose, so longer strings get replaced first)
-        for md in metadata.itertuples(index=False):
-
-            replacedStrings.extend(md.strSearch.upper().split())
-            
-            if md.conflicts or md.ambiguous:
-                # delay replacement until NER, if e.g., title equals character name
-                continue
-                
-            pdSeries = self._replace_searchStr(pdSeries, md.strSearchEscaped, md.strReplace, True, md.category == 'PERSON')
+        # (all in one scan per review, longer strings still take precedence)
+        pdSeries = pdSeries.apply(matcher.replace)
 
         # remove double words and confusing word combinations
         for rep in REPETITIONS_1:
@@ -414,95 +974,60 @@ class NLP:
             
         # replace/remove common abbreviations, unless they are part of a title or name
         for abb in ABBREVIATIONS:
-            if abb[0] not in replacedStrings:
+            if abb[0] not in matcher.replaced_words:
                 pdSeries = self._replace_searchStr(pdSeries, abb[0], abb[1], True, True, True)
         
         return pdSeries
         
 
-    def _split_sentences(self, text):
-
-        sentences = []
-        open_parentesis = False
+    def split_sentences(self, pdSeries, workers = 1, chunk_size = 1000):
+        """ split review into sentences
         
-        for sentence in self._sent_detector.tokenize(text):
+          Arguments:
+            workers: number of processes, to split chunks of reviews in parallel
+            chunk_size: number of reviews per chunk
+        """
+
+        if workers > 1 and len(pdSeries.index) > chunk_size:
+            return map_chunks(_split_chunk, pdSeries, self._worker_pool(workers), chunk_size)
+
+        return pd.Series(split_reviews(pdSeries, self._sent_detector), index=pdSeries.index, name=pdSeries.name, dtype=object)
         
-            #clean up split sentences
-            if sentence in NONE_SENTENCES:
-                continue
-            #numbered list 1.
-            if re.fullmatch(r'#?(\d){1,2}[\.\)]+', sentence):
-                continue
-                
-            sentence = re.sub(r'^(\d){1,2}[\.\)]+ ', '', sentence)
-            
-            #inline numbered list 2.
-            if re.search(r'(?<! is)(?<! the)(?<! of)(?<! Volume) (\d)\. ', sentence):
-                nr_list = re.split(r'(?<! is)(?<! the)(?<! of)(?<! Volume) (\d)\. ', sentence)
-                for sentence in nr_list:
-                    if sentence == '':
-                        continue
-                        
-                    if (not sentences) or (re.match(r'[A-Z]', sentence)):
-                        sentences.append(sentence)
-                    else:
-                        sentences[-1] = f"{sentences[-1]}{'' if (sentences[-1][-1] in '.,:;!?') else ','} {sentence}"
-                
-                open_parentesis = False
-            #inline numbered list 3)
-            elif (not open_parentesis) and re.search(r' \d\) ', sentence) and not re.search(r'\(.* \d\) ', sentence):
-                nr_list = re.split(r' \d\) ', sentence)
-                for sentence in nr_list:
-                    if sentence == '':
-                        continue
-                        
-                    if (not sentences) or (re.match(r'[A-Z]', sentence)):
-                        sentences.append(sentence)
-                    else:
-                        sentences[-1] = f"{sentences[-1]}{'' if (sentences[-1][-1] in '.,:;!?') else ','} {sentence}"
-                
-            #fix for nltk splitting sentences too freely, whenever there is a punctuation
-            elif sentences and (sentence.startswith("'s ") or re.match(r'[\'"]?[\.,:;!\?\)]', sentence)):
-                sentences[-1] = f'{sentences[-1]}{sentence}'
-                open_parentesis = False
-            #join short sentences, e.g., 'Yes.', 'Why?'
-            elif (not ' ' in sentence) and any(char.isalpha() for char in sentence):
-                if not sentences: #one-word review beginning
-                    sentences.append(sentence)
-                    open_parentesis = True
-                    continue
-                
-                sentences[-1] = f'{sentences[-1]} {sentence}'
-                open_parentesis = False
-            #greedily split sentences with screwed punctuation
-            elif len(sentence) > SENTENCE_MAXLENGTH:
-                sentences.extend([f'{s.strip()}.' for s in re.split(r'[\.;](?=[ a-dfh-zA-Z])', sentence)])
-                open_parentesis = False
-            elif open_parentesis:
-                #TODO: consider more than two sentences in parentheses 
-                sentences[-1] = f'{sentences[-1]} {sentence}'
-                open_parentesis = False
-            else:
-                sentences.append(sentence)
         
-            #keep parentheses together
-            if ('(' in sentence) and (not ')' in sentence):
-                open_parentesis = True
+    def _pipe_reviews(self, pdSeries, batch_size, n_process, disable=()):
+        """ parse the sentences of all reviews in one spacy stream
         
-        return sentences
-
-    def split_sentences(self, pdSeries):
-        """ split review into sentences """
-
-        return pdSeries.apply(self._split_sentences)
+          Arguments:
+            pdSeries: lists of sentences per review
+            batch_size: number of sentences per spacy batch
+            n_process: number of processes for spacy
+            disable: pipes to disable
+            
+          Returns:
+            new pdSeries with lists of spacy docs per review
+        """
         
+        docs = self._nlp.pipe(itertools.chain.from_iterable(pdSeries), batch_size=batch_size, n_process=n_process, disable=disable)
         
-    def get_tokens_from_sentences(self, pdSeries):
+        # regroup docs per review
+        return pd.Series([list(itertools.islice(docs, len(sentences))) for sentences in pdSeries], index=pdSeries.index, dtype=object)
+
+    def get_tokens_from_sentences(self, pdSeries, batch_size=256, n_process=1):
         """ tokenize sentences for reviews with unknown title
            (otherwise this is done implicitly in _replace_propernames_corefs)
+           
+          Arguments:
+            pdSeries: individual sentences
+            batch_size: number of sentences per spacy batch
+            n_process: number of processes for spacy
+            
+          Returns:
+            new pdSeries with list of tokens per sentence
         """
         
-        return pdSeries.apply(lambda sentences: [[(token.text, token.whitespace_, token.pos_) for token in sentence] for sentence in self._nlp.pipe(sentences, disable=['ner', 'ner_split_fix'])])
+        docs = self._nlp.pipe(pdSeries, batch_size=batch_size, n_process=n_process, disable=['ner', 'ner_split_fix'])
+        
+        return pd.Series([[(token.text, token.whitespace_, token.pos_) for token in doc] for doc in docs], index=pdSeries.index, dtype=object)
 
     def _get_corefs(self, sentences):
         """ performs coreference resolution
@@ -596,19 +1121,26 @@ class NLP:
         return [[(self._replace_propername_coref(token, getRefText(next(counter))), token.whitespace_, token.pos_) for token in sentence] for sentence in pdRow['tokens']]
         
 
-    def replace_propernames_corefs(self, pdSeries, metadata):
+    def replace_propernames_corefs(self, pdSeries, metadata, batch_size=256, n_process=1):
         """ replacement of proper names and coreferences with spacy & maverick
             (should be done after replacing conflict-free metadata)
             
-            returns new pdSeries with individual tokens
+          Arguments:
+            pdSeries: lists of sentences per review
+            metadata: imdb metadata from DB.get_metadata_replacements
+            batch_size: number of sentences per spacy batch
+            n_process: number of processes for spacy
+            
+          Returns:
+            new pdSeries with individual tokens
         """
 
         conflicts = metadata[metadata['ambiguous'] | metadata['conflicts']]
 
-        if len(conflicts.index) == 0:
-            tokens = pdSeries.apply(lambda sentences: [sentence for sentence in self._nlp.pipe(sentences)])
-        else:
-            tokens = pdSeries.apply(self._handle_name_conflicts, conflicts=conflicts)
+        tokens = self._pipe_reviews(pdSeries, batch_size, n_process)
+
+        if len(conflicts.index) != 0:
+            self._handle_name_conflicts(tokens, conflict_index(conflicts), batch_size, n_process)
 
         refs = {}
         if self._coref:
@@ -619,58 +1151,59 @@ class NLP:
         return df.apply(self._replace_propernames_corefs, axis=1)
       
       
-    def _handle_name_conflicts(self, sentences, conflicts):
+    def _handle_name_conflicts(self, tokens, conflicts, batch_size, n_process):
+        """ replace conflicting names according to their NER label
+            , and re-parse modified sentences in place
+        
+          Arguments:
+            tokens: lists of spacy docs per review
+            conflicts: index from metadata.conflict_index
+        """
 
-        docs = []
-        for sentence in self._nlp.pipe(sentences):
-            
-            new_sentence = sentence.text
-            
-            searchStrings = conflicts['strSearch'].unique()
-            for strSearch in searchStrings:
-            
-                repl = conflicts[conflicts['strSearch'] == strSearch]
-                
-                strSearch_nocase = strSearch.casefold()
-                
-                if strSearch_nocase not in sentence.text.casefold():
-                    continue
-                
-                char_offset = 0 #handles offset in spacy spans, when a name has to be replaced more than once in a sentence
-                
-                for ent in sentence.ents:
-                    if strSearch_nocase == ent.text.casefold():
-                        replacement = repl[repl['category'] == ent.label_]
-                        if len(replacement.index) != 0:
-                            #TODO: currently the first entry from the matching category is taken, i.e., it doesn't handle one person having multiple jobs
-                            strReplace = replacement.iloc[0]['strReplace']
-                            new_sentence = new_sentence[:ent.start_char + char_offset] + strReplace + new_sentence[ent.end_char + char_offset:]
-                            char_offset = len(strReplace) - (ent.end_char - ent.start_char)
-                
-                
-                # if NER failed for title/name conflict, use title as fallback #TODO: make config
-                caseSensitive = True
-                if " " in strSearch:
-                    caseSensitive = False
-                    strSearch = strSearch_nocase
-                    
-                if not repl.iloc[0]['ambiguous'] and (strSearch in (new_sentence if caseSensitive else new_sentence.casefold())):
-                    flags = re.U if caseSensitive else re.I
-                    new_sentence = re.sub(f'{SEARCH_PREFIX}{repl.iloc[0]["strSearchEscaped"]}{SEARCH_SUFFIX}', repl.iloc[0]["strReplace"], new_sentence, flags=flags)
-            
-            if new_sentence == sentence.text:
-                docs.append(sentence)
-            else:
-                new_sentence = re.sub(r'[\'\"]this movie[\'\"]', 'this movie', new_sentence)
-                
-                for rep in REPETITIONS_1:
-                    new_sentence = re.sub(f'{SEARCH_PREFIX}{rep[0]}{SEARCH_SUFFIX}', rep[1], new_sentence, flags=re.I)
-            
-                new_sentence = re.sub(r'  +', ' ', new_sentence)
-                
-                docs.append(self._nlp(new_sentence))
+        modified = []
+        for docs in tokens:
+            for i, sentence in enumerate(docs):
+                new_sentence = self._resolve_name_conflicts(sentence, conflicts)
+                if new_sentence is not None:
+                    modified.append((docs, i, new_sentence))
+
+        for (docs, i, _), doc in zip(modified, self._nlp.pipe([m[2] for m in modified], batch_size=batch_size, n_process=n_process)):
+            docs[i] = doc
+
+    def _resolve_name_conflicts(self, sentence, conflicts):
+        """ returns new sentence text, or None if nothing was replaced """
+
+        text = sentence.text
+        text_nocase = text.casefold()
+
+        new_sentence = text
+
+        # replace recognized entities (from the end, to keep character offsets)
+        for ent in reversed(sentence.ents):
+            conflict = conflicts.get(ent.text.casefold())
+            if conflict is not None:
+                strReplace = conflict[0].get(ent.label_)
+                if strReplace is not None:
+                    new_sentence = new_sentence[:ent.start_char] + strReplace + new_sentence[ent.end_char:]
+
+        # if NER failed for title/name conflict, use title as fallback
+        for strSearch_nocase, (_, fallback) in conflicts.items():
+            if (fallback is None) or (strSearch_nocase not in text_nocase):
+                continue
+
+            strSearch, caseSensitive, regex, strReplace = fallback
+            if strSearch in (new_sentence if caseSensitive else new_sentence.casefold()):
+                new_sentence = regex.sub(strReplace, new_sentence)
+
+        if new_sentence == text:
+            return None
+
+        new_sentence = re.sub(r'[\'\"]this movie[\'\"]', 'this movie', new_sentence)
         
-        return docs
+        for rep in REPETITIONS_1:
+            new_sentence = re.sub(f'{SEARCH_PREFIX}{rep[0]}{SEARCH_SUFFIX}', rep[1], new_sentence, flags=re.I)
+    
+        return re.sub(r'  +', ' ', new_sentence)
 
 
     def get_sentence_from_tokens(self, pdSeries, metadata):
@@ -703,19 +1236,30 @@ class NLP:
         return pdSeries
 
 
-    def estimate_polarity(self, pdSeries):
+    def estimate_polarity(self, pdSeries, workers=1, chunk_size=1000):
         """ estimate sentence polarity with vader
         
+            Arguments:
+                pdSeries: sentences
+                workers: number of processes, if there are more sentences than chunk_size
+                chunk_size: number of sentences per process call
+        
             Returns:
-                new pdSeries with pos, neg, neutral & compound scores
+                new DataFrame with neg, neu, pos & compound scores
                 (though only compound score is used in the app)
         """
 
-        polarity = pdSeries.apply(self._sia.polarity_scores)
-        return pd.DataFrame(polarity.tolist(), index=pdSeries.index)
+        if workers > 1 and len(pdSeries.index) > chunk_size:
+            # (only send distinct sentences, since the per-worker caches do not see each other's hits)
+            codes, uniques = pd.factorize(pdSeries, use_na_sentinel=False)
+            scores = np.array(map_chunks(_polarity_chunk, pd.Series(uniques), self._worker_pool(workers), chunk_size).tolist(), dtype=float)[codes]
+        else:
+            scores = score_polarities(pdSeries.tolist(), self._polarity_scores)
+
+        return pd.DataFrame(scores.reshape(-1, len(POLARITY_COLUMNS)), index=pdSeries.index, columns=POLARITY_COLUMNS)
     
 
-    def preprocess_text(self, text, metadata, sent_polarity = True):
+    def preprocess_text(self, text, metadata, sent_polarity = True, matcher = None):
         """ go through all preprocess steps
             to turn an original review into inferable sentences
             
@@ -723,21 +1267,44 @@ class NLP:
             text: review text as str
             metadata: imdb metadata - pass None to skip metadata & propername replacement
             sent_polarity: pass False to skip estimating sentence polarities
+            matcher: compiled MetadataMatcher for the metadata, see DB.get_metadata_matcher
         
         Returns:
             pandas Series with sentences
         """
         
-        df = pd.DataFrame({'text': [text]})
+        df = self.preprocess_reviews(pd.Series([text]), metadata, sent_polarity, matcher)
+        
+        return df.drop(columns=['review'])
+        
         
-        df['text'] = self.normalize_reviews(df['text'])
+    def preprocess_reviews(self, pdSeries, metadata, sent_polarity = True, matcher = None, normalForm = 'NFKC'
+                               , workers = 1, chunk_size = 1000, batch_size = 256, n_process = 1):
+        """ go through all preprocess steps
+            to turn original reviews (of the same title) into inferable sentences
+            
+        Arguments:
+            pdSeries: series of review texts
+            metadata: imdb metadata - pass None to skip metadata & propername replacement
+            sent_polarity: pass False to skip estimating sentence polarities
+            matcher: compiled MetadataMatcher for the metadata, see DB.get_metadata_matcher
+            normalForm, workers, chunk_size: see normalize_reviews
+            batch_size, n_process: see replace_propernames_corefs
+        
+        Returns:
+            DataFrame with sentences, incl. index of their review in column 'review'
+        """
+        
+        df = pd.DataFrame({'review': pdSeries.index, 'text': pdSeries.values})
+        
+        df['text'] = self.normalize_reviews(df['text'], normalForm, workers, chunk_size)
 
         if (metadata is not None) and (len(metadata.index) != 0):
-            df['text'] = self.replace_metadata(df['text'], metadata)
+            df['text'] = self.replace_metadata(df['text'], metadata, matcher)
         
-            splits = self.split_sentences(df['text']) 
+            splits = self.split_sentences(df['text'], workers, chunk_size) 
 
-            df['tokens'] = self.replace_propernames_corefs(splits, metadata)
+            df['tokens'] = self.replace_propernames_corefs(splits, metadata, batch_size, n_process)
            
             df = df.explode('tokens', ignore_index=True)
             
@@ -746,45 +1313,98 @@ class NLP:
             df = df[~pd.isna(df['sentence'])]
 
         else:    
-            df['sentence'] = self.split_sentences(df['text'])
+            df['sentence'] = self.split_sentences(df['text'], workers, chunk_size)
             
             df = df.explode('sentence', ignore_index=True)
             
-        df = df[['sentence']]
+            # reviews without any sentence
+            df = df[~pd.isna(df['sentence'])]
+            
+        df = df[['review', 'sentence']]
 
         df['sentence'] = self.add_aspect_term(df['sentence'])
         
         if sent_polarity:
-            polarity = self.estimate_polarity(df['sentence'])
+            polarity = self.estimate_polarity(df['sentence'], workers, chunk_size)
 
             df = pd.concat([df, polarity], axis=1)
         
         return df
         
 
-    def predict_absa(self, pdSeries, aspect_terms):
+    def quantize_setfit(self):
+        """ switch setfit bodies to dynamic int8 quantization for CPU inference """
+        
+        if self._setfit_inference == 'int8':
+            return
+        
+        setfit = self._setfit
+        
+        if self._embedding_store is not None:
+            # stored embeddings belong to the fp32 bodies
+            from imdb_absa.embeddings import detach_embedding_store
+            
+            detach_embedding_store(setfit.aspect_model.model_body)
+            detach_embedding_store(setfit.polarity_model.model_body)
+        
+        quantize_body(setfit.aspect_model.model_body)
+        quantize_body(setfit.polarity_model.model_body)
+        
+        # predictions differ slightly from the fp32 models
+        self._setfit_inference = 'int8'
+        self.setfit_model_id = f'{self.setfit_model_id}+int8'
+        
+        if self._embedding_store is not None:
+            self._attach_embedding_stores(setfit)
+        
+
+    def predict_absa(self, pdSeries, aspect_terms, token_budget=None):
         """ predict aspect based sentiments for series of sentences
         
         Arguments:
             pdSeries: series of sentences
-            aspect_terms: predefined aspect terms mapped to categories
+            aspect_terms: AspectTermIndex, or DataFrame of predefined aspect terms mapped to categories
+            token_budget: if given, sentences are passed to setfit in groups of similar length
+                          with at most this number of (padded) words per call, to bound the memory per call
+                          (the sentence transformers sort their inputs by length on their own)
             
         Returns:
             List of spacy docs
             List of aspects incl. polarity label and aspect categories
+            (both in the order of the input series)
         """
         
-        if not hasattr(self, '_setfit'):
+        if not self._setfit_active:
             logging.warning(f"Sentiment prediction impossible, as NLP was initiated without a setfit model.")
 
 
         sentences = pdSeries.values
 
-        docs, aspects = self._setfit.predict_to_docs(sentences)
+        if token_budget is None or len(sentences) == 0:
+            docs, aspects = self._setfit.predict_to_docs(sentences)
+            
+        else:
+            # approximate token count by words
+            batches = length_batches([len(sentence.split()) for sentence in sentences], token_budget)
+            
+            docs = [None] * len(sentences)
+            aspects = [None] * len(sentences)
+            
+            for batch in batches:
+                batch_docs, batch_aspects = self._setfit.predict_to_docs(sentences[batch])
+                
+                # restore original order
+                for i, doc, doc_aspects in zip(batch, batch_docs, batch_aspects):
+                    docs[i] = doc
+                    aspects[i] = doc_aspects
   
-        for doc_aspects in aspects:
-            for aspect in doc_aspects:
-                aspect.categories = get_aspect_categories(aspect.context.lower(), aspect_terms)
+        if not isinstance(aspect_terms, AspectTermIndex):
+            aspect_terms = AspectTermIndex(aspect_terms)
+        
+        flat = [aspect for doc_aspects in aspects for aspect in doc_aspects]
+        
+        for aspect, categories in zip(flat, aspect_terms.categories_batch([aspect.context.lower() for aspect in flat])):
+            aspect.categories = categories
         
         return docs, aspects
   
@@ -803,50 +1423,49 @@ class NLP:
            ,Boolean for overall binary classification
         """
 
-        if not hasattr(self, '_clf_2'):
-            logging.warning(f"Classification impossible, as NLP was initiated without classifier models.")
+        aspect_means, recommendations = self.predict_sentiments_batch([(genres, sentences, aspects)], features)
+    
+        return aspect_means[0], recommendations[:1]
+  
 
+    def predict_sentiments_batch(self, reviews, features):
+        """ calculates final sentiment scores for many reviews,
+            with one call of each classifier
+        
+        Arguments:
+            reviews: list of (genres, sentences, aspects) for each review, see predict_sentiments
+            features: DataFrame with columns matching classifier inputs
+            
+        Returns:
+            List of DataFrames with aspect_category: discrete rating (1,2,3,4,5)
+           ,numpy array of Booleans for overall binary classification
+        """
 
-        #set review polarity
-        features.at[0, 'mean_review_polarity'] = sentences['compound'].mean()
+        if not self._clf_active:
+            logging.warning(f"Classification impossible, as NLP was initiated without classifier models.")
 
-        #set genre 'flags'
-        for genre in genres:
-            if f'genre_{genre}' in features.columns:
-                features.at[0, f'genre_{genre}'] = 1
 
-        #set aspect 'count' features
-        sentences['absa'] = [[(aspect.categories, aspect.label) for aspect in doc_aspects] for doc_aspects in aspects]
-        
-        sentences = sentences.explode('absa', ignore_index=True)
-        
-        sentences['absa'] = sentences['absa'].apply(lambda a: a if isinstance(a, tuple) else ({'None'},'none'))
+        X, means = build_features(reviews, features)
             
-        sentences[['aspect','polarity']] = pd.DataFrame(sentences['absa'].tolist(), index=sentences.index)
-
-        sentences = sentences.explode('aspect', ignore_index=True)
+        #compute aspect rating  
+        means['rating'] = pd.cut(means['polarity_value'], [-1,-0.6,-0.2,0.2,0.6,1.0], labels=[1,2,3,4,5], include_lowest=True).astype('str')
 
-        sentences['polarity_value'] = sentences['polarity'].map(POLARITY_MAPPING)
+        means = means.set_index('review')
         
-        for sentence in sentences.itertuples(index=False):
-            features.at[0, f"{sentence.aspect}_{sentence.polarity.replace(' ','_')}"] += 1
-            
-        #set aspect 'mean' features
-        aspect_means = sentences.groupby(by=['aspect'])[['compound','polarity_value']].mean().reset_index()
+        aspect_means = [means.loc[[row]].reset_index(drop=True) if row in means.index else means.iloc[:0].reset_index(drop=True)
+                        for row in range(len(reviews))]
+        
+        #predict overall rating, for reviews without overall aspect
+        without_overall = [row for row, review_means in enumerate(aspect_means) if 'Overall' not in review_means['aspect'].values]
         
-        for mean in aspect_means.itertuples(index=False):
-            features.at[0, f'{mean.aspect}_mean'] = mean.compound
+        if len(without_overall) != 0:
             
-        #compute aspect rating  
-        aspect_means['rating'] = pd.cut(aspect_means['polarity_value'], [-1,-0.6,-0.2,0.2,0.6,1.0], labels=[1,2,3,4,5], include_lowest=True).astype('str')
-
-        if 'Overall' not in aspect_means['aspect'].values:
+            overall = self._clf_5.predict(X[without_overall])
             
-            #predict overall rating
-            overall = pd.DataFrame({'aspect':'Overall', 'rating':self._clf_5.predict(features.values)})
-            aspect_means = pd.concat([aspect_means, overall], ignore_index=True)
+            for row, rating in zip(without_overall, overall):
+                aspect_means[row] = pd.concat([aspect_means[row], pd.DataFrame({'aspect':'Overall', 'rating':[rating]})], ignore_index=True)
   
         #predict binary classification
-        recommendation = self._clf_2.predict(features.values)
+        recommendations = self._clf_2.predict(X)
     
-        return aspect_means, recommendation
\ No newline at end of file
+        return aspect_means, recommendations
\ No newline at end of file
@@ -0,0 +1,147 @@
+import argparse
+import functools
+import json
+import pandas as pd
+import time
+
+from imdb_absa.aspects import AspectTermIndex
+from imdb_absa.config import Config
+from imdb_absa.db import DB
+from imdb_absa.nlp import NLP
+
+
+def read_reviews(path, batch_size, title_column):
+    """ yields DataFrames of batch_size reviews from a csv or jsonl file """
+
+    if path.endswith('.jsonl') or path.endswith('.json'):
+        reader = pd.read_json(path, lines=True, chunksize=batch_size, dtype={title_column: str})
+    else:
+        reader = pd.read_csv(path, chunksize=batch_size, dtype={title_column: str})
+
+    with reader:
+        yield from reader
+
+
+def json_value(value):
+    """ converts numpy scalars for json serialization """
+
+    return value.item() if hasattr(value, 'item') else value
+
+
+def score_batch(nlp, db, config, reviews, args, aspect_terms, features, get_genres):
+    """ preprocess and predict a batch of reviews
+
+      Returns:
+        dict of review index: (aspect ratings, recommendation), for reviews with at least one sentence
+    """
+
+    texts = reviews[args.text_column]
+    texts = texts[texts.notna() & (texts.astype(str).str.strip() != '')].astype(str)
+
+    titles = reviews.loc[texts.index, args.title_column] if args.title_column in reviews.columns else pd.Series(None, index=texts.index, dtype=object)
+
+    # unknown format is handled like a missing title id
+    titles = titles.where(titles.astype(str).str.fullmatch(r'tt\d+'))
+
+    # titles may have been updated since the last batch
+    db.refresh_metadata_cache()
+
+    # preprocess reviews of the same title together
+    sentences = []
+    for title_id, title_texts in texts.groupby(titles.fillna(''), sort=False):
+
+        metadata = None if title_id == '' else db.get_metadata_replacements(title_id)
+        matcher = None if title_id == '' else db.get_metadata_matcher(title_id)
+
+        sentences.append(nlp.preprocess_reviews(title_texts, metadata, True, matcher, config.pre_normal
+                                               ,config.pre_workers, config.pre_chunk_size, config.pre_spacy_batch_size, config.pre_spacy_processes))
+
+    if len(sentences) == 0:
+        return dict()
+
+    sentences = pd.concat(sentences, ignore_index=True)
+
+    if len(sentences.index) == 0:
+        return dict()
+
+    _, aspects = nlp.predict_absa(sentences['sentence'], aspect_terms, config.model_setfit_token_budget)
+
+    positions = sentences.groupby('review', sort=False).indices
+
+    scored = list(positions)
+
+    inputs = [(get_genres(titles[review]) if pd.notna(titles[review]) else []
+              ,sentences.iloc[positions[review]]
+              ,[aspects[i] for i in positions[review]]) for review in scored]
+
+    aspect_means, recommendations = nlp.predict_sentiments_batch(inputs, features)
+
+    return {review: ({mean.aspect: int(mean.rating) for mean in means.itertuples(index=False) if mean.aspect != 'None'}, bool(recommendation))
+            for review, means, recommendation in zip(scored, aspect_means, recommendations)}
+
+
+if __name__ == "__main__":
+    """ Score reviews from a csv or jsonl file with per-aspect ratings and a binary recommendation
+        (streamed in batches, without saving anything to the review tables)
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('input', type=str, help='csv or jsonl file with review texts and imdb title ids')
+    parser.add_argument('output', type=str, help='jsonl file to write scores to')
+    parser.add_argument('--text_column', type=str, default='text', help='column with review texts')
+    parser.add_argument('--title_column', type=str, default='title_id', help='column with imdb title ids, e.g., "tt0133093"')
+    parser.add_argument('--id_column', type=str, default='id', help='column with review ids (default: line number)')
+    parser.add_argument('--batch_size', type=int, default=1000, help='number of reviews processed at once')
+    args = parser.parse_args()
+
+    config = Config()
+
+    db = DB(config.database, pragmas=config.database_pragmas)
+
+
+    print('Loading models')
+
+    nlp = NLP(config.model_spacy, config.model_spacy_exclude
+            , config.model_maverick, config.pre_coref_resolution
+            , config.model_setfit, True
+            , config.model_classifier, True
+            , embedding_store=config.model_embedding_store, embedding_dtype=config.model_embedding_dtype
+            , setfit_inference=config.model_setfit_inference, setfit_threads=config.model_setfit_threads)
+
+    aspect_terms = AspectTermIndex(db.get_aspect_terms())
+
+    features = db.get_review_polarities_input()
+
+    get_genres = functools.lru_cache(maxsize=4096)(db.get_genres_for_title)
+
+
+    print('Scoring reviews')
+
+    count = 0
+    start = time.perf_counter()
+
+    with open(args.output, 'w', encoding='utf-8') as file:
+
+        for reviews in read_reviews(args.input, args.batch_size, args.title_column):
+
+            scores = score_batch(nlp, db, config, reviews, args, aspect_terms, features, get_genres)
+
+            for index, review in reviews.iterrows():
+
+                ratings, recommendation = scores.get(index, ({}, None))
+
+                record = {'id': json_value(review[args.id_column]) if args.id_column in reviews.columns else index
+                         ,'title_id': json_value(review[args.title_column]) if args.title_column in reviews.columns and pd.notna(review[args.title_column]) else None
+                         ,'ratings': ratings
+                         ,'recommendation': recommendation}
+
+                file.write(json.dumps(record) + '\n')
+
+            file.flush()
+
+            count += len(reviews.index)
+            print(f'{count} reviews scored ({count / (time.perf_counter() - start):.1f} reviews/s)')
+
+    nlp.close()
+
+    print('Done.')
@@ -150,7 +150,7 @@ if __name__ == "__main__":
     if len(db_path.parents) > 0:
         db_path.parents[0].mkdir(parents=True, exist_ok=True)
     
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas)
     
     print('Removing current names & principals')
     db.clear_imdb_names()
@@ -258,6 +258,11 @@ if __name__ == "__main__":
     ambigous_names = pd.read_csv(config.import_ambiguous)
     
     db.update_names_ambiguous(ambigous_names)
+
+
+    print('Building metadata replacements for new or changed titles')
+
+    count_metadata = db.update_metadata_replacements()
     
     
     print('Reading in aspect terms')
@@ -269,4 +274,4 @@ if __name__ == "__main__":
     print('cleaning up database')
     db.vacuum()
 
-    print(f'Imported {count_titles} imdb titles and {count_names} names.')
\ No newline at end of file
+    print(f'Imported {count_titles} imdb titles and {count_names} names, updated metadata replacements for {count_metadata} titles.')
\ No newline at end of file
@@ -8,8 +8,9 @@ from spacy import displacy
 from spacy.tokens.span import Span
 from dash import Dash, html, dcc, ctx, callback, Output, Input, State
 from itertools import count
-from threading import Timer
+from threading import Thread, Timer
 
+from imdb_absa.aspects import AspectTermIndex
 from imdb_absa.db import DB
 from imdb_absa.config import Config
 from imdb_absa.nlp import NLP
@@ -91,11 +92,12 @@ class imdb_absa_dash:
         self.gpu = gpu #determines spacy model preference
 
         self.titles = db.get_titles_for_selection(genre_id) #movies for dropdown
-        self.aspect_terms = db.get_aspect_terms() #aspect terms to determine categories
+        self.aspect_terms = AspectTermIndex(db.get_aspect_terms()) #aspect terms to determine categories
         self.features = db.get_review_polarities_input() #DataFrame to use for classification
         
         self.genres = [] #genres for selected movie (there's always more than one)
         self.metadata = None #selected movie's title and principals
+        self.matcher = None #compiled metadata replacements
         
         self.counter = count(0) #counter to keep reloading gifs
         
@@ -182,8 +184,11 @@ class imdb_absa_dash:
         if (title_id == None) or (title_id == ''):
             return '', 'Please select a movie.', True, True, app.STYLES['disabled'], app.STYLES['disabled']
     
+        db.refresh_metadata_cache()
+
         app.genres = db.get_genres_for_title(title_id)
         app.metadata = db.get_metadata_replacements(title_id)
+        app.matcher = db.get_metadata_matcher(title_id)
 
         return '', 'Get a random review, or write your own.', False, False, app.STYLES['button'], app.STYLES['button']
 
@@ -237,7 +242,7 @@ class imdb_absa_dash:
         if app.gpu:
             spacy.prefer_gpu()
 
-        app.sentences = nlp.preprocess_text(review_text, app.metadata)
+        app.sentences = nlp.preprocess_text(review_text, app.metadata, matcher=app.matcher)
         
         docs, app.aspects = nlp.predict_absa(app.sentences['sentence'], app.aspect_terms)
 
@@ -295,13 +300,17 @@ class imdb_absa_dash:
 if __name__ == '__main__':
 
     config = Config()
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas)
 
-    print('loading models')
     nlp = NLP(config.model_spacy, config.model_spacy_exclude
             , config.model_maverick, config.pre_coref_resolution
             , config.model_setfit, True
-            , config.model_classifier, True)
+            , config.model_classifier, True
+            , setfit_inference=config.model_setfit_inference, setfit_threads=config.model_setfit_threads)
+
+    # load models in the background, while the server is starting
+    print('loading models')
+    Thread(target=nlp.warmup, daemon=True).start()
 
 
     print('starting server')
@@ -14,7 +14,7 @@ if __name__ == "__main__":
     else:
         config = Config()
         
-        db = DB(config.database)
+        db = DB(config.database, pragmas=config.database_pragmas, report_writes=True)
         db.assure_database()
     
         csv = sys.argv[1]
@@ -12,7 +12,7 @@ if __name__ == "__main__":
     config = Config()
     
     print('Assuring database')
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas, report_writes=True, word_storage=config.database_word_storage)
     db.assure_database()
 
     print('initializing NLP models')
@@ -26,7 +26,7 @@ if __name__ == "__main__":
     count_reviews = len(reviews)
     count_sentences = 0
     
-    reviews['normalizedText'] = nlp.normalize_reviews(reviews['originalText'], config.pre_normal)
+    reviews['normalizedText'] = nlp.normalize_reviews(reviews['originalText'], config.pre_normal, config.pre_workers, config.pre_chunk_size)
 
     # update normalizedText in review table
     db.update_reviews(reviews)
@@ -39,7 +39,7 @@ if __name__ == "__main__":
         print('handling reviews for unknown titles')
 
         #split into sentences
-        reviews_noTitle['sentence'] = nlp.split_sentences(reviews_noTitle['normalizedText'])
+        reviews_noTitle['sentence'] = nlp.split_sentences(reviews_noTitle['normalizedText'], config.pre_workers, config.pre_chunk_size)
         
         reviews_noTitle = reviews_noTitle.explode('sentence', ignore_index=True)
     
@@ -51,7 +51,7 @@ if __name__ == "__main__":
         
         
         #estimate sentence polarities
-        polarity = nlp.estimate_polarity(reviews_noTitle['sentence'])
+        polarity = nlp.estimate_polarity(reviews_noTitle['sentence'], config.pre_workers, config.pre_chunk_size)
 
         reviews_noTitle = pd.concat([reviews_noTitle, polarity], axis=1)
             
@@ -59,7 +59,7 @@ if __name__ == "__main__":
         
         
         #split into tokens with POS tags
-        reviews_noTitle['tokens'] = nlp.get_tokens_from_sentences(reviews_noTitle['sentence'])
+        reviews_noTitle['tokens'] = nlp.get_tokens_from_sentences(reviews_noTitle['sentence'], config.pre_spacy_batch_size, config.pre_spacy_processes)
         
         reviews_noTitle = reviews_noTitle[['tokens']]
         
@@ -78,6 +78,7 @@ if __name__ == "__main__":
 
     # preprocess with metadata for each movie 
     titles = reviews['title_id'].unique()    
+    db.refresh_metadata_cache()
     for title_id in titles:
     
         print(f'processing reviews for {title_id} ...')
@@ -86,19 +87,19 @@ if __name__ == "__main__":
 
         metadata = db.get_metadata_replacements(title_id)
         
-        reviews_title['normalizedText'] = nlp.replace_metadata(reviews_title['normalizedText'], metadata)
+        reviews_title['normalizedText'] = nlp.replace_metadata(reviews_title['normalizedText'], metadata, db.get_metadata_matcher(title_id))
   
   
         print('splitting reviews into sentences')
         
-        splits = nlp.split_sentences(reviews_title['normalizedText']) 
+        splits = nlp.split_sentences(reviews_title['normalizedText'], config.pre_workers, config.pre_chunk_size)
 
         reviews_title.drop(columns=['normalizedText'], inplace=True)
 
 
         print(f"tokenizing sentences and replacing proper names{' & coreferences' if config.pre_coref_resolution else ''}")
 
-        reviews_title['tokens'] = nlp.replace_propernames_corefs(splits, metadata)
+        reviews_title['tokens'] = nlp.replace_propernames_corefs(splits, metadata, config.pre_spacy_batch_size, config.pre_spacy_processes)
        
         reviews_title = reviews_title.explode('tokens', ignore_index=True)
 
@@ -119,7 +120,7 @@ if __name__ == "__main__":
         
         print('estimating sentence polarity')
                 
-        polarity = nlp.estimate_polarity(reviews_title['sentence'])
+        polarity = nlp.estimate_polarity(reviews_title['sentence'], config.pre_workers, config.pre_chunk_size)
 
         reviews_title = pd.concat([reviews_title, polarity], axis=1)
             
@@ -139,6 +140,8 @@ if __name__ == "__main__":
         db.import_words(tokens)
   
   
+    nlp.close()
+  
     print('cleaning up database...')
     db.vacuum()
     
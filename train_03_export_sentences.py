@@ -35,7 +35,7 @@ if __name__ == "__main__":
 
     config = Config()
     
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas)
     db.assure_database()
 
     print('Collecting sample sentences')
@@ -1,15 +1,15 @@
 import pandas as pd
 
+from imdb_absa.aspects import AspectTermIndex
 from imdb_absa.config import Config
 from imdb_absa.db import DB
-from imdb_absa.nlp import get_aspect_categories
 
 if __name__ == "__main__":
     """ Read in doccano annotations and save as gold aspect labels to sqlite database """
 
     config = Config()    
     
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas, report_writes=True)
     db.assure_database()
 
     print('Reading in annotations')
@@ -31,9 +31,9 @@ if __name__ == "__main__":
 
     print('Adding aspect categories')
  
-    aspect_terms = db.get_aspect_terms()
+    aspect_terms = AspectTermIndex(db.get_aspect_terms())
 
-    annotations['category'] = annotations['aspect_context'].apply(get_aspect_categories,aspect_terms=aspect_terms)
+    annotations['category'] = aspect_terms.categories_batch(annotations['aspect_context'])
 
     annotations = annotations.explode('category')
 
@@ -11,10 +11,15 @@ from transformers import EarlyStoppingCallback
     
 from imdb_absa.config import Config
 from imdb_absa.db import DB
+from imdb_absa.embeddings import EmbeddingStore, attach_embedding_store
 
 
-def train_model(database, ratings_csv, model_spacy, config):
-    """ Train a new setfit absa model """
+def train_model(database, ratings_csv, model_spacy, config, embedding_store=None, embedding_dtype='float16'):
+    """ Train a new setfit absa model
+    
+      Arguments:
+        embedding_store: folder to keep embeddings in, reused when only training the classifiers (epochs_embedding = 0)
+    """
 
     print('Assuring database')
     db = DB(database)
@@ -40,6 +45,13 @@ def train_model(database, ratings_csv, model_spacy, config):
 
     model = AbsaModel.from_pretrained(config.model_base, spacy_model=model_spacy, spacy_disable_pipes=['ner','lemmatizer'])
 
+    if (embedding_store is not None) and (config.epochs_embedding == 0):
+        # the base model is not fine-tuned, so its embeddings can be reused between runs
+        store = EmbeddingStore(embedding_store, config.model_base, embedding_dtype)
+        
+        attach_embedding_store(model.aspect_model.model_body, store)
+        attach_embedding_store(model.polarity_model.model_body, store)
+
     args = TrainingArguments(
         output_dir="models",
         num_epochs=(config.epochs_embedding, config.epochs_classifier),
@@ -87,5 +99,6 @@ if __name__ == "__main__":
             print('No model "{model}" defined in config.json')
             
         else:
-            train_model(config.database, config.train_ratings, config.model_spacy, config.train_models[model])
+            train_model(config.database, config.train_ratings, config.model_spacy, config.train_models[model]
+                       ,config.model_embedding_store, config.model_embedding_dtype)
     
\ No newline at end of file
@@ -1,11 +1,343 @@
 import argparse
+import multiprocessing
 import pandas as pd
+import queue
 import spacy
+import threading
 import time
+import traceback
 
+from imdb_absa.aspects import AspectTermIndex
 from imdb_absa.config import Config
 from imdb_absa.db import DB
-from imdb_absa.nlp import NLP
+from imdb_absa.nlp import NLP, sentence_hash
+
+
+def load_nlp(config, use_embedding_store=True):
+    """ load spaCy and setfit models for prediction
+
+      Arguments:
+        use_embedding_store: use config.model_embedding_store, if set
+                             (only for a single process, since the store is not safe for concurrent writers)
+    """
+
+    return NLP(config.model_spacy, config.model_spacy_exclude, config.model_maverick, False, config.model_setfit, True
+              ,embedding_store=config.model_embedding_store if use_embedding_store else None, embedding_dtype=config.model_embedding_dtype
+              ,setfit_inference=config.model_setfit_inference, setfit_threads=config.model_setfit_threads)
+
+
+def read_chunk(db, args, model_id, sentences):
+    """ get hashes and cached predictions for a chunk of sentences """
+
+    hashes = sentences['text'].apply(sentence_hash)
+
+    predictions = {} if args.no_cache else db.get_cached_predictions(hashes.unique(), model_id)
+
+    return sentences, hashes, predictions
+
+
+def predict_chunk(nlp, aspect_terms, token_budget, sentences, hashes, predictions):
+    """ predict sentences without cached predictions
+
+      Returns:
+        dict of sentence_hash: list of (aspect_term, ordinal, context, polarity) for newly predicted sentences
+        (predictions are updated with these as well)
+    """
+
+    uncached = ~hashes.isin(list(predictions))
+
+    new_predictions = {}
+
+    if uncached.any():
+
+        _, aspects = nlp.predict_absa(sentences.loc[uncached, 'text'], aspect_terms, token_budget)
+
+        # (plain python types, to be json serializable for the prediction cache)
+        new_predictions = dict(zip(hashes[uncached], [[(str(aspect.text), int(aspect.ordinal), str(aspect.context), str(aspect.label)) for aspect in doc_aspects] for doc_aspects in aspects]))
+
+        predictions.update(new_predictions)
+
+    return new_predictions
+
+
+def save_chunk(db, aspect_terms, model_id, sentences, hashes, predictions, new_predictions):
+    """ save predicted aspects of a chunk and mark its sentences as analyzed """
+
+    sentence_ids = sentences['id'].unique().tolist()
+
+    if len(new_predictions) != 0:
+        db.cache_predictions(new_predictions, model_id)
+
+    absa = [predictions[h] for h in hashes]
+
+    categories = iter(aspect_terms.categories_batch([context.lower() for doc_aspects in absa for _, _, context, _ in doc_aspects]))
+
+    sentences['absa'] = [[(text, ordinal, next(categories), label) for text, ordinal, context, label in doc_aspects] for doc_aspects in absa]
+
+    sentences = sentences.explode('absa')
+
+    sentences = sentences[~sentences['absa'].isna()]
+
+    sentences[['aspect_term','ordinal','category','polarity']] = pd.DataFrame(sentences['absa'].tolist(), index=sentences.index)
+
+    sentences = sentences.explode('category')
+
+    sentences['sentiment_term'] = ''
+
+    sentences['verified'] = 0 # not gold aspects
+
+
+    #save to sql
+
+    sentences = sentences[['id', 'category', 'aspect_term', 'ordinal', 'polarity', 'sentiment_term', 'verified']]
+
+    db.import_sentence_aspects(sentences)
+
+    db.update_sentences_analyzed(sentence_ids)
+
+
+def read_chunks(db, args, model_id, chunks):
+    """ producer: reads chunks of sentences incl. cached predictions ahead of the model """
+
+    last_id = None
+
+    while True:
+
+        sentences = db.get_sentences_for_prediction(args.genre_id, args.chunk_size, last_id)
+
+        if len(sentences.index) == 0:
+            break
+
+        last_id = int(sentences['id'].max())
+
+        chunks.put(read_chunk(db, args, model_id, sentences))
+
+
+def write_chunks(db, aspect_terms, model_id, results):
+    """ consumer: saves predicted chunks to the database """
+
+    while True:
+
+        result = results.get()
+
+        if result is None:
+            break
+
+        save_chunk(db, aspect_terms, model_id, *result)
+
+
+def run_thread(target, done, drain, errors, *args):
+    """ runs target in a daemon thread, recording exceptions
+      , signaling the end with None to the done queue
+      , and after an exception, discarding items from the drain queue, so the main thread doesn't block
+    """
+
+    def run():
+        try:
+            target(*args)
+        except Exception as e:
+            errors.append(e)
+            if drain is not None:
+                while drain.get() is not None:
+                    pass
+        finally:
+            if done is not None:
+                done.put(None)
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+
+    return thread
+
+
+def predict_pipelined(db, config, args):
+    """ predict in this process, while reading and saving in background threads """
+
+    print('Loading models')
+
+    nlp = load_nlp(config)
+
+    aspect_terms = AspectTermIndex(db.get_aspect_terms())
+
+
+    # read ahead and save in background, so the model doesn't wait on the database
+    chunks = queue.Queue(maxsize=args.queue_size)
+    results = queue.Queue(maxsize=args.queue_size)
+    errors = []
+
+    reader = run_thread(read_chunks, chunks, None, errors, db, args, nlp.setfit_model_id, chunks)
+    writer = run_thread(write_chunks, None, results, errors, db, aspect_terms, nlp.setfit_model_id, results)
+
+    count = 0
+    start = time.perf_counter()
+
+    try:
+        while True:
+
+            chunk = chunks.get()
+
+            if chunk is None or errors:
+                break
+
+            sentences, hashes, predictions = chunk
+
+            print(f'Predicting aspect based sentiments for chunk of {len(sentences.index)} sentences ({hashes.isin(list(predictions)).sum()} cached)...')
+
+            new_predictions = predict_chunk(nlp, aspect_terms, config.model_setfit_token_budget, sentences, hashes, predictions)
+
+            # blocks if the writer falls behind
+            results.put((sentences, hashes, predictions, new_predictions))
+
+            count += len(sentences.index)
+            print(f'{count} sentences predicted ({count / (time.perf_counter() - start):.1f} sentences/s)')
+
+    finally:
+        # save the chunks predicted so far, even if the model failed
+        print('Saving remaining chunks to database')
+
+        results.put(None)
+        writer.join()
+
+    if errors:
+        raise errors[0]
+
+
+def predict_worker(worker, args, tasks, results):
+    """ worker process: loads the models once, then predicts claimed ranges of sentences until there are none left """
+
+    try:
+        config = Config()
+
+        db = DB(config.database, pragmas=config.database_pragmas)
+
+        # workers would append to the same embedding store files concurrently
+        nlp = load_nlp(config, use_embedding_store=False)
+
+        aspect_terms = AspectTermIndex(db.get_aspect_terms())
+
+        results.put(('model', worker, nlp.setfit_model_id))
+
+        count = 0
+        start = time.perf_counter()
+
+        while True:
+
+            id_range = tasks.get()
+
+            if id_range is None:
+                break
+
+            results.put(('claim', worker, id_range))
+
+            sentences = db.get_sentences_for_prediction(args.genre_id, args.chunk_size, id_range[0] - 1, id_range[1])
+
+            sentences, hashes, predictions = read_chunk(db, args, nlp.setfit_model_id, sentences)
+
+            new_predictions = predict_chunk(nlp, aspect_terms, config.model_setfit_token_budget, sentences, hashes, predictions)
+
+            results.put(('chunk', worker, id_range, (sentences, hashes, predictions, new_predictions)))
+
+            count += len(sentences.index)
+            print(f'worker {worker}: {count} sentences predicted ({count / (time.perf_counter() - start):.1f} sentences/s)', flush=True)
+
+    except Exception:
+        results.put(('error', worker, traceback.format_exc()))
+        raise SystemExit(1)
+
+    results.put(('done', worker))
+
+
+def predict_sharded(db, config, args):
+    """ predict in worker processes, each claiming disjoint ranges of sentence ids
+      , and save the results in this process
+
+      a crashed worker only loses the range it was predicting,
+      which can be predicted afterwards with --resume
+      
+      Returns:
+        number of chunks that were not predicted
+    """
+
+    ranges = db.get_sentence_ranges_for_prediction(args.genre_id, args.chunk_size)
+
+    if config.model_embedding_store is not None:
+        print('The embedding store is not used with multiple workers.')
+
+    print(f'Starting {args.workers} workers for {len(ranges)} chunks of sentences')
+
+    tasks = multiprocessing.Queue()
+    for id_range in ranges:
+        tasks.put(id_range)
+    for _ in range(args.workers):
+        tasks.put(None)
+
+    results = multiprocessing.Queue(maxsize=args.queue_size * args.workers)
+
+    processes = [multiprocessing.Process(target=predict_worker, args=(worker, args, tasks, results), daemon=True) for worker in range(args.workers)]
+    for process in processes:
+        process.start()
+
+    aspect_terms = AspectTermIndex(db.get_aspect_terms())
+
+    model_id = None
+    in_flight = dict()
+    finished = set()
+    saved = set()
+    count = 0
+    start = time.perf_counter()
+
+    while len(finished) < len(processes):
+
+        try:
+            kind, worker, *message = results.get(timeout=1)
+
+        except queue.Empty:
+            # check for crashed workers, once their queued results are processed
+            for worker, process in enumerate(processes):
+                if worker not in finished and not process.is_alive():
+                    finished.add(worker)
+                    id_range = in_flight.pop(worker, None)
+                    print(f'worker {worker} stopped with exit code {process.exitcode}'
+                         + ('' if id_range is None else f', while predicting sentences {id_range[0]} to {id_range[1]}'))
+            continue
+
+        if kind == 'claim':
+            in_flight[worker] = message[0]
+
+        elif kind == 'chunk':
+            id_range, chunk = message
+
+            save_chunk(db, aspect_terms, model_id, *chunk)
+
+            in_flight.pop(worker, None)
+            saved.add(tuple(id_range))
+
+            count += len(chunk[0].index)
+            print(f'saved sentences {id_range[0]} to {id_range[1]} from worker {worker}, {count} sentences in total ({count / (time.perf_counter() - start):.1f} sentences/s)')
+
+        elif kind == 'model':
+            model_id = message[0]
+
+        elif kind == 'error':
+            print(f'worker {worker} failed:\n{message[0]}')
+
+        elif kind == 'done':
+            finished.add(worker)
+
+    for process in processes:
+        process.join()
+
+    # (ranges nobody claimed may be left, if all workers stopped early)
+    tasks.cancel_join_thread()
+
+    # every dispatched range that wasn't saved, no matter when its worker stopped
+    missing = [id_range for id_range in ranges if tuple(id_range) not in saved]
+
+    if len(missing) != 0:
+        print(f'{len(missing)} chunks of sentences were not predicted (first: sentences {missing[0][0]} to {missing[0][1]}), run again with --resume to predict them.')
+
+    return len(missing)
+
 
 if __name__ == "__main__":
     """ Predict aspect based sentiment polarity and save to sqlite database """
@@ -13,71 +345,36 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--genre_id', type=int, default=-1, help='filter by genre')
     parser.add_argument('--chunk_size', type=int, default=7500, help='number of sentences predicted per batch')
+    parser.add_argument('--no_cache', action='store_true', help='predict all sentences, instead of reusing cached predictions of the same setfit model')
+    parser.add_argument('--queue_size', type=int, default=2, help='number of chunks read ahead / waiting to be saved (per worker)')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes, each loading its own models')
+    parser.add_argument('--resume', action='store_true', help='keep previous predictions and only predict sentences not analyzed yet')
     args = parser.parse_args()
 
-    config = Config()    
-    
+    config = Config()
+
     print('Assuring database')
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas)
     db.assure_database()
 
-    print('Deleting previous predictions from database')
-    
-    db.reset_predictions(args.genre_id)
-    
+    if not args.resume:
+        print('Deleting previous predictions from database')
+
+        db.reset_predictions(args.genre_id)
+
 
     print('Getting sentences')
 
-    sentences = db.get_sentences_for_prediction(**vars(args))
-    
-    if len(sentences.index) == 0:
+    if len(db.get_sentences_for_prediction(args.genre_id, 1).index) == 0:
         print('No sentences to predict.')
-    
+
+    elif args.workers > 1:
+        if predict_sharded(db, config, args) != 0:
+            raise SystemExit(1)
+
+        print('Done.')
+
     else:
-    
-        print('Loading models')
-
-        nlp = NLP(config.model_spacy, config.model_spacy_exclude, config.model_maverick, False, config.model_setfit, True)
-
-
-        while len(sentences.index) != 0:
-            
-            print('Predicting aspect based sentiments for chunk of sentences...')
-             
-            sentence_ids = sentences['id'].unique()
-            
-            aspect_terms = db.get_aspect_terms()
-            
-            _, aspects = nlp.predict_absa(sentences['text'], aspect_terms)
-
-            
-            print('Saving to database')
-            
-            sentences['absa'] = [[(aspect.text, aspect.ordinal, aspect.categories, aspect.label) for aspect in doc_aspects] for doc_aspects in aspects]
-            
-            sentences = sentences.explode('absa')
-            
-            sentences = sentences[~sentences['absa'].isna()]
-            
-            sentences[['aspect_term','ordinal','category','polarity']] = pd.DataFrame(sentences['absa'].tolist(), index=sentences.index)
-                    
-            sentences = sentences.explode('category')
-                    
-            sentences['sentiment_term'] = ''
-            
-            sentences['verified'] = 0 # not gold aspects
-
-
-            #save to sql
-
-            sentences = sentences[['id', 'category', 'aspect_term', 'ordinal', 'polarity', 'sentiment_term', 'verified']]
-            
-            db.import_sentence_aspects(sentences)
-            
-            db.update_sentences_analyzed(sentence_ids)
-            
-            # get next chunk
-            sentences = db.get_sentences_for_prediction(**vars(args))
-            
-            
-        print('Done.')
\ No newline at end of file
+        predict_pipelined(db, config, args)
+
+        print('Done.')
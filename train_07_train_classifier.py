@@ -24,7 +24,7 @@ if __name__ == "__main__":
     config = Config()    
     
     print('Assuring database')
-    db = DB(config.database)
+    db = DB(config.database, pragmas=config.database_pragmas)
     db.assure_database()
 
 